@@ -0,0 +1,106 @@
+import json
+import uuid
+import threading
+from datetime import datetime
+
+from tracing import annotate
+from code_cache import task_terms
+
+
+class SemanticAnswerCache:
+    """
+    Cache of solve_query answers looked up by prompt embedding similarity
+
+    Entries live in their own Chroma collection (cosine space) and are tagged with the
+    version of the source collection they were computed from, so any write to the
+    source through DBManager makes them unreachable; stale entries are purged on store.
+    A hit also needs the same literals and content words as the cached prompt, since
+    questions differing only in a field ID or year embed almost identically.
+    """
+
+    def __init__(self, db_manager, collection_name="answer_cache", source_collection="data_store",
+                 threshold=0.95, near_miss_margin=0.05):
+        self.db_manager = db_manager
+        self.source_collection = source_collection
+        self.threshold = threshold
+        self.near_miss_margin = near_miss_margin
+        self.collection = db_manager.get_collection(collection_name, metadata={"hnsw:space": "cosine"})
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_misses = 0  # misses within near_miss_margin below the threshold
+        self.hit_similarity_total = 0.0
+
+    @staticmethod
+    def _files_key(file_paths):
+        return json.dumps(sorted(file_paths or []))
+
+    def data_version(self):
+        return self.db_manager.collection_version(self.source_collection)
+
+    def lookup(self, prompt, file_paths=None, data_version=None):
+        """Return (result, similarity) for the closest cached answer above the threshold, or (None, similarity)"""
+        data_version = self.data_version() if data_version is None else data_version
+        similarity = None
+        try:
+            matches = self.collection.query(
+                query_texts=[prompt],
+                n_results=1,
+                where={"$and": [
+                    {"data_version": data_version},
+                    {"file_paths": self._files_key(file_paths)},
+                    {"terms": task_terms(prompt)}
+                ]},
+                include=["metadatas", "distances"]
+            )
+            if matches["ids"][0]:
+                similarity = 1 - matches["distances"][0][0]
+                if similarity >= self.threshold:
+                    with self._lock:
+                        self.hits += 1
+                        self.hit_similarity_total += similarity
+                    annotate(cache_hit=True, similarity=similarity)
+                    return json.loads(matches["metadatas"][0][0]["result"]), similarity
+        except Exception as e:
+            print(f"Answer cache lookup error: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+            if similarity is not None and similarity >= self.threshold - self.near_miss_margin:
+                self.near_misses += 1
+        annotate(cache_hit=False, similarity=similarity)
+        return None, similarity
+
+    def store(self, prompt, file_paths, result, data_version):
+        """Cache an answer computed against data_version and drop entries from older versions"""
+        try:
+            if data_version != self.data_version():
+                # The data store changed while this answer was being computed
+                return
+            self.collection.delete(where={"data_version": {"$ne": data_version}})
+            self.collection.add(
+                documents=[prompt],
+                metadatas=[{
+                    "data_version": data_version,
+                    "file_paths": self._files_key(file_paths),
+                    "terms": task_terms(prompt),
+                    "result": json.dumps(result),
+                    "created_at": datetime.now().isoformat()
+                }],
+                ids=[str(uuid.uuid4())]
+            )
+        except Exception as e:
+            print(f"Answer cache store error: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "near_misses": self.near_misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "mean_hit_similarity": self.hit_similarity_total / self.hits if self.hits else None,
+                "threshold": self.threshold
+            }
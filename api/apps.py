@@ -0,0 +1,16 @@
+import os
+import threading
+
+from django.apps import AppConfig
+
+
+class ApiConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api'
+
+    def ready(self):
+        """Warm up the shared QuerySolver in the background so the first request doesn't pay for it"""
+        if os.getenv("QUERY_SOLVER_WARMUP", "1") == "0":
+            return
+        from .query_solver import warm_up
+        threading.Thread(target=warm_up, name="query-solver-warmup", daemon=True).start()
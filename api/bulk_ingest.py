@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+import sqlite3
+import argparse
+import mimetypes
+import multiprocessing
+import traceback
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from chunking import chunk_pages
+from db_manager import get_db_manager
+from context_packer import TokenCounter
+from columnar_store import ColumnarStore
+from extractors import extract_file
+from ingest_queue import hash_file
+
+
+BULK_EXTENSIONS = ('.txt', '.csv', '.json', '.pdf')
+
+_token_counter = None
+
+
+def _extract(path, root, chunk_size, chunk_overlap, tables_root):
+    """Read, extract, chunk and count embedding tokens of one file - runs in a worker process"""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter("text-embedding-ada-002")
+
+    file_type = mimetypes.guess_type(path)[0] or ""
+    # Parallelism is across files here, so PDFs are parsed in this process
+    content, extra_metadata = extract_file(path, file_type, workers=1)
+    chunks = list(chunk_pages(content, chunk_size, chunk_overlap))
+    content_hash = hash_file(path)
+    metadata = {
+        "filename": os.path.basename(path),
+        "relative_path": os.path.relpath(path, root),
+        "file_type": file_type,
+        "file_size": os.path.getsize(path),
+        "source": "bulk_ingest",
+        "local_path": path,
+        "content_hash": content_hash,
+        **extra_metadata,
+        **ColumnarStore(tables_root).ingest(path, content_hash)
+    }
+    return chunks, metadata, sum(_token_counter.count(chunk["text"]) for chunk in chunks)
+
+
+class IngestCheckpoint:
+    """Files already loaded by previous runs, keyed by path and identified by size and mtime"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                collection TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                doc_id TEXT,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (collection, path)
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, collection, path):
+        row = self._conn.execute("SELECT * FROM files WHERE collection = ? AND path = ?", (collection, path)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, collection, rows):
+        """Save [(path, size, mtime_ns, doc_id, chunks, status, error)] in one transaction"""
+        now = datetime.now().isoformat()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(collection, *row, now) for row in rows]
+        )
+        self._conn.commit()
+
+
+def walk_files(root, extensions=BULK_EXTENSIONS):
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(names):
+            if name.lower().endswith(extensions):
+                yield os.path.join(directory, name)
+
+
+class Throughput:
+    """Running totals and rates of a bulk load"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = {"documents": 0, "chunks": 0, "tokens": 0, "skipped": 0, "failed": 0}
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] += value
+
+    def report(self):
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **self.counts,
+            "seconds": round(seconds, 2),
+            "docs_per_second": round(self.counts["documents"] / seconds, 2),
+            "chunks_per_second": round(self.counts["chunks"] / seconds, 2),
+            "embedding_tokens_per_second": round(self.counts["tokens"] / seconds, 1)
+        }
+
+    def line(self):
+        report = self.report()
+        return (f"{report['documents']} docs ({report['docs_per_second']}/s), "
+                f"{report['chunks']} chunks ({report['chunks_per_second']}/s), "
+                f"{report['tokens']} embedding tokens ({report['embedding_tokens_per_second']}/s), "
+                f"{report['skipped']} skipped, {report['failed']} failed")
+
+
+def bulk_ingest(db_manager, root, collection_name="data_store", checkpoint_path="./cache/bulk_ingest.db",
+                concurrency=None, batch_chunks=1000, report_interval=10.0, log=print):
+    """
+    Load every txt/csv/json/pdf file under root into a collection
+
+    Files are extracted and chunked in a pool of concurrency processes and written to
+    the store in batches of about batch_chunks chunks, so embedding requests and Chroma
+    adds are shared across small files. Each written batch is checkpointed: a rerun skips
+    files loaded unchanged, replaces files that changed since, and retries failed ones.
+
+    Returns the final throughput report.
+    """
+    root = os.path.abspath(root)
+    concurrency = concurrency or os.cpu_count() or 1
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    throughput = Throughput()
+    last_report = time.monotonic()
+
+    pending = []  # (path, size, mtime_ns, doc_id, chunks, metadata, tokens) waiting to be written
+    replaced = []
+
+    def flush():
+        if not pending:
+            return
+        if replaced:
+            db_manager.delete_many(collection_name, replaced)
+            replaced.clear()
+        db_manager.store_chunks(
+            collection_name,
+            [(chunks, metadata) for _, _, _, _, chunks, metadata, _ in pending],
+            doc_ids=[doc_id for _, _, _, doc_id, _, _, _ in pending],
+            upsert=True
+        )
+        checkpoint.record(collection_name, [
+            (path, size, mtime_ns, doc_id, len(chunks), "done", None)
+            for path, size, mtime_ns, doc_id, chunks, _, _ in pending
+        ])
+        throughput.add(
+            documents=len(pending),
+            chunks=sum(len(chunks) for _, _, _, _, chunks, _, _ in pending),
+            tokens=sum(tokens for *_, tokens in pending)
+        )
+        pending.clear()
+
+    def collect(future, path, size, mtime_ns, doc_id, previous_doc_id):
+        try:
+            chunks, metadata, tokens = future.result()
+        except Exception as e:
+            log(f"Error extracting {path}:\n{traceback.format_exc()}")
+            # Keep pointing at the stored version so it is replaced once the file loads
+            checkpoint.record(collection_name, [(path, size, mtime_ns, previous_doc_id, 0, "failed", str(e))])
+            throughput.add(failed=1)
+            return
+        if previous_doc_id and previous_doc_id != doc_id:
+            replaced.append(previous_doc_id)
+        pending.append((path, size, mtime_ns, doc_id, chunks, metadata, tokens))
+        if sum(len(item[4]) for item in pending) >= batch_chunks:
+            flush()
+
+    # Spawned, not forked: the DBManager's Chroma and SQLite threads already hold locks here
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight = deque()
+        for path in walk_files(root):
+            stat = os.stat(path)
+            previous = checkpoint.get(collection_name, path)
+            if (previous and previous["status"] == "done"
+                    and (previous["size"], previous["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)):
+                throughput.add(skipped=1)
+                continue
+
+            # Ids are derived from the file version, so a retried batch overwrites its own chunks
+            doc_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{collection_name}:{path}:{stat.st_size}:{stat.st_mtime_ns}"))
+            future = executor.submit(_extract, path, root, db_manager.chunk_size, db_manager.chunk_overlap,
+                                     db_manager.tables.root)
+            in_flight.append((future, path, stat.st_size, stat.st_mtime_ns, doc_id, previous and previous["doc_id"]))
+            # Keep at most two files per worker extracted ahead of the writer
+            while len(in_flight) >= concurrency * 2:
+                collect(*in_flight.popleft())
+
+            if time.monotonic() - last_report >= report_interval:
+                log(throughput.line())
+                last_report = time.monotonic()
+        while in_flight:
+            collect(*in_flight.popleft())
+        flush()
+
+    log(throughput.line())
+    return throughput.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a directory tree of txt/csv/json/pdf files into the vector store")
+    parser.add_argument("root")
+    parser.add_argument("--collection", default="data_store")
+    parser.add_argument("--persist-dir", default="./vector_db")
+    parser.add_argument("--checkpoint", default="./cache/bulk_ingest.db", help="Progress file used to resume")
+    parser.add_argument("--concurrency", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--batch-chunks", type=int, default=1000, help="Chunks per embedding/write batch")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    bulk_ingest(
+        get_db_manager(args.persist_dir),
+        args.root,
+        collection_name=args.collection,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency,
+        batch_chunks=args.batch_chunks,
+        report_interval=args.report_interval
+    )
+
+
+if __name__ == "__main__":
+    main()
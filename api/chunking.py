@@ -0,0 +1,56 @@
+import re
+
+
+_BREAK_PATTERNS = [re.compile(r"\n\s*\n"), re.compile(r"[.!?]\s"), re.compile(r"\s")]
+
+
+def _find_break(text, end, min_end):
+    """Find where to end a chunk before end, preferring paragraph, then sentence, then word boundaries"""
+    window = text[min_end:end]
+    for pattern in _BREAK_PATTERNS:
+        matches = list(pattern.finditer(window))
+        if matches:
+            return min_end + matches[-1].end()
+    return end
+
+
+def chunk_text(text, chunk_size=1500, chunk_overlap=200):
+    """
+    Split text into overlapping chunks of at most chunk_size characters
+
+    Yields (start, end, chunk) with character offsets into text. Cuts are moved back
+    to the nearest natural boundary within the last fifth of each window.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            end = _find_break(text, end, start + int(chunk_size * 0.8))
+        chunk = text[start:end].strip()
+        if chunk:
+            yield start, end, chunk
+        if end >= length:
+            break
+        start = max(end - chunk_overlap, start + 1)
+
+
+def chunk_pages(content, chunk_size=1500, chunk_overlap=200):
+    """
+    Chunk a document given either as one string or as an iterable of page strings
+
+    Yields dicts with the chunk text and its page/offset metadata. Pages are consumed
+    lazily so a generator of pages is never materialized in full.
+    """
+    pages = [(None, content)] if isinstance(content, str) else enumerate(content, start=1)
+    index = 0
+    for page, text in pages:
+        for start, end, chunk in chunk_text(text or "", chunk_size, chunk_overlap):
+            item = {"text": chunk, "chunk_index": index, "start_offset": start, "end_offset": end}
+            if page is not None:
+                item["page"] = page
+            yield item
+            index += 1
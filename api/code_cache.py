@@ -0,0 +1,294 @@
+import io
+import os
+import re
+import ast
+import json
+import marshal
+import sqlite3
+import hashlib
+import threading
+import tokenize
+from datetime import datetime
+
+
+_LITERAL = re.compile(r'"([^"]*)"|\'([^\']*)\'|(?<![\w.])(-?\d+(?:\.\d+)?)(?![\w.])')
+
+
+def task_signature(prompt, files=None, depth=0):
+    """
+    Normalize a task prompt into (signature, arguments)
+
+    Quoted strings and numbers become typed slots, so "average yield of field 12" and
+    "average yield of field 7" share a signature and differ only in their arguments.
+    """
+    arguments = []
+
+    def slot(match):
+        double, single, number = match.groups()
+        if number is not None:
+            arguments.append(float(number) if "." in number else int(number))
+            return "<num>"
+        arguments.append(double if double is not None else single)
+        return "<str>"
+
+    normalized = _LITERAL.sub(slot, prompt)
+    normalized = re.sub(r"\s+", " ", normalized).strip().lower().rstrip(".?!")
+    return f"{normalized}|{json.dumps(sorted(files or []))}|{depth}", arguments
+
+
+# Words a paraphrase may add, drop or swap without changing the task
+_FILLER_WORDS = frozenset(
+    "a an the of for in on at to by from with and is are was what whats what's which "
+    "please give me show find get tell compute calculate return".split()
+)
+
+
+def _content(signature):
+    """The slot sequence and content words of a signature, for matching paraphrased prompts"""
+    normalized = signature.split("|", 1)[0]
+    words = re.findall(r"<num>|<str>|[\w']+", normalized)
+    slots = [word for word in words if word in ("<num>", "<str>")]
+    return slots, sorted(word for word in words if word not in _FILLER_WORDS and word not in ("<num>", "<str>"))
+
+
+def task_terms(prompt):
+    """
+    The literals and content words of a prompt, as a string key
+
+    Prompts with equal terms ask the same question in different words; "yield of
+    field F-12 in 2022" and "... in 2023" don't, however close their embeddings are.
+    """
+    signature, arguments = task_signature(prompt)
+    slots, words = _content(signature)
+    return json.dumps([slots, words, arguments])
+
+
+# Bumped when _template changes so snippets templated the old way are dropped
+TEMPLATE_VERSION = 2
+
+# Python 3.12+ tokenizes f-strings into parts; their text can contain a literal too
+_FSTRING_MIDDLE = getattr(tokenize, "FSTRING_MIDDLE", None)
+
+
+def _literal_tokens(code):
+    """
+    Return (start, end, value, text) for each number and string token in code, with a
+    minus sign folded into the number it negates
+    """
+    lines = code.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+
+    def offset(position):
+        return offsets[position[0] - 1] + position[1]
+
+    literals = []
+    previous = None
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == _FSTRING_MIDDLE:
+            literals.append((offset(token.start), offset(token.end), None, token.string))
+        elif token.type in (tokenize.NUMBER, tokenize.STRING):
+            try:
+                value = ast.literal_eval(token.string)
+            except (ValueError, SyntaxError):
+                value = None  # f-strings and the like can only contain a literal
+            start = offset(token.start)
+            if (token.type == tokenize.NUMBER and previous is not None and previous.string == "-"
+                    and previous.end == token.start and value is not None):
+                start, value = offset(previous.start), -value
+            literals.append((start, offset(token.end), value, token.string))
+        if token.type not in (tokenize.NL, tokenize.COMMENT):
+            previous = token
+    return literals
+
+
+def _template(code, arguments):
+    """
+    Replace the prompt's literals in code with __arg_<i>__ names; returns (template, templated flags)
+
+    Only whole number and string literals are replaced, and only where the value appears
+    exactly once, typically in the call that passes it to the generated method. A value
+    that also occurs inside a larger literal ("2023" in "2023-01-01") is left alone and
+    must then match exactly on reuse.
+    """
+    try:
+        literals = _literal_tokens(code)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return code, [False] * len(arguments)
+
+    replacements = []
+    templated = []
+    for index, value in enumerate(arguments):
+        whole = [(start, end) for start, end, literal, _ in literals
+                 if type(literal) is type(value) and literal == value]
+        text = str(value)
+        partial = any(text in source for _, _, literal, source in literals
+                      if not (type(literal) is type(value) and literal == value)
+                      and (isinstance(literal, str) or literal is None))
+        if len(whole) == 1 and not partial:
+            replacements.append((whole[0], f"__arg_{index}__"))
+            templated.append(True)
+        else:
+            templated.append(False)
+
+    for (start, end), name in sorted(replacements, reverse=True):
+        code = code[:start] + name + code[end:]
+    return code, templated
+
+
+class CodeCache:
+    """
+    Validated generated-code snippets, reusable for tasks with the same signature
+
+    Snippets are stored with their compiled bytecode and the prompt literals turned
+    into variables, so a hit runs with new arguments and no GPT-4 round trip. Lookups
+    that miss the exact signature fall back to the nearest cached prompt by embedding
+    when it only rephrases this one.
+    """
+
+    def __init__(self, db_manager, path="./cache/code_cache.db", collection_name="code_cache", similarity_threshold=0.97):
+        self.similarity_threshold = similarity_threshold
+        self.collection = db_manager.get_collection(collection_name, metadata={"hnsw:space": "cosine"})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS snippets (
+                key TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                template TEXT NOT NULL,
+                bytecode BLOB NOT NULL,
+                arguments TEXT NOT NULL,
+                templated TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL
+            )"""
+        )
+        self._conn.commit()
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < TEMPLATE_VERSION:
+            self._clear()
+
+    def _clear(self):
+        """Drop snippets templated by an older version of _template"""
+        keys = [row[0] for row in self._conn.execute("SELECT key FROM snippets")]
+        self._conn.execute("DELETE FROM snippets")
+        self._conn.execute(f"PRAGMA user_version = {TEMPLATE_VERSION}")
+        self._conn.commit()
+        if keys:
+            try:
+                self.collection.delete(ids=keys)
+            except Exception as e:
+                print(f"Code cache clear error: {str(e)}")
+
+    @staticmethod
+    def _key(signature):
+        return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+    def _load(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, bytecode, arguments, templated FROM snippets WHERE key = ?", (key,)
+            ).fetchone()
+        return row
+
+    def lookup(self, prompt, files=None, depth=0):
+        """Return {"key", "bytecode", "globals"} for a reusable snippet, or None"""
+        signature, arguments = task_signature(prompt, files, depth)
+        row = self._load(self._key(signature))
+        if row is None:
+            row = self._nearest(prompt, signature, files, depth)
+        if row is not None:
+            key, bytecode, cached_arguments, templated = row
+            cached_arguments, templated = json.loads(cached_arguments), json.loads(templated)
+            # Literals that aren't variables in the snippet must match exactly
+            compatible = len(arguments) == len(cached_arguments) and all(
+                flag or new == old for new, old, flag in zip(arguments, cached_arguments, templated)
+            )
+            if compatible:
+                with self._lock:
+                    self._conn.execute("UPDATE snippets SET uses = uses + 1 WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.hits += 1
+                return {
+                    "key": key,
+                    "bytecode": bytecode,
+                    "globals": {f"__arg_{index}__": value for index, value in enumerate(arguments)}
+                }
+        self.misses += 1
+        return None
+
+    def _nearest(self, prompt, signature, files, depth):
+        """
+        The closest cached snippet by embedding, if its prompt is a paraphrase of this one
+
+        Near-identical embeddings aren't enough: "yield for field Alpha" and "yield for
+        field Beta" differ only in an unquoted word the snippet hardcodes. A candidate
+        must have the same slots in the same order and the same content words.
+        """
+        try:
+            matches = self.collection.query(
+                query_texts=[prompt],
+                n_results=1,
+                where={"$and": [{"files": json.dumps(sorted(files or []))}, {"depth": depth}]},
+                include=["distances"]
+            )
+        except Exception as e:
+            print(f"Code cache lookup error: {str(e)}")
+            return None
+        if not matches["ids"][0] or 1 - matches["distances"][0][0] < self.similarity_threshold:
+            return None
+        key = matches["ids"][0][0]
+        with self._lock:
+            candidate = self._conn.execute("SELECT signature FROM snippets WHERE key = ?", (key,)).fetchone()
+        if candidate is None or _content(candidate[0]) != _content(signature):
+            return None
+        return self._load(key)
+
+    def store(self, prompt, files, code, depth=0):
+        """Cache a snippet that completed its task"""
+        signature, arguments = task_signature(prompt, files, depth)
+        template, templated = _template(code, arguments)
+        try:
+            bytecode = marshal.dumps(compile(template, "<cached-snippet>", "exec"))
+        except SyntaxError:
+            return
+        key = self._key(signature)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snippets VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                (key, signature, template, bytecode, json.dumps(arguments), json.dumps(templated), datetime.now().isoformat())
+            )
+            self._conn.commit()
+        try:
+            self.collection.upsert(
+                documents=[prompt],
+                metadatas=[{"files": json.dumps(sorted(files or [])), "depth": depth}],
+                ids=[key]
+            )
+        except Exception as e:
+            print(f"Code cache store error: {str(e)}")
+
+    def evict(self, key):
+        """Drop a snippet that failed when reused"""
+        with self._lock:
+            self._conn.execute("DELETE FROM snippets WHERE key = ?", (key,))
+            self._conn.commit()
+        try:
+            self.collection.delete(ids=[key])
+        except Exception as e:
+            print(f"Code cache evict error: {str(e)}")
+        self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
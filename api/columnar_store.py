@@ -0,0 +1,434 @@
+import os
+import csv
+import json
+import shutil
+import threading
+
+import numpy as np
+
+
+TABLE_EXTENSIONS = ('.csv', '.json')
+
+_AGGREGATES = ("count", "sum", "mean", "min", "max")
+_DATE_PARTS = {"year": "datetime64[Y]", "month": "datetime64[M]", "day": "datetime64[D]"}
+
+
+# Rows converted and written per step, so a table never has to fit in memory as Python lists
+CHUNK_ROWS = 65536
+
+
+def _open_records(path):
+    """
+    Return (column names, rows) of a CSV file or a JSON table, or None if it isn't tabular
+
+    rows() yields each row as a list and can be called again for a second pass. CSV
+    files are streamed from disk; JSON has to be parsed whole, but its rows are
+    still produced one at a time.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            header = next(csv.reader(f), None)
+        if not header:
+            return None
+
+        def csv_rows():
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for row in reader:
+                    yield row + [""] * (len(header) - len(row))
+
+        return header, csv_rows
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        # {"column": [values], ...} or {"records": [{...}, ...], ...}
+        if data and all(isinstance(value, list) for value in data.values()):
+            lengths = {len(value) for value in data.values()}
+            if len(lengths) == 1 and not any(isinstance(item, dict) for value in data.values() for item in value):
+                columns = list(data.values())
+                return list(data), lambda: (list(row) for row in zip(*columns))
+        data = next((value for value in data.values() if isinstance(value, list) and value and isinstance(value[0], dict)), None)
+    if not isinstance(data, list) or not data or not all(isinstance(record, dict) for record in data):
+        return None
+    names = list(dict.fromkeys(name for record in data for name in record))
+    return names, lambda: ([record.get(name) for name in names] for record in data)
+
+
+def _chunks(rows, size=CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_int(value):
+    if isinstance(value, float):
+        raise ValueError("not an integer")
+    return int(value)
+
+
+def _missing(value):
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
+
+def _leading_zero(value):
+    """Identifiers such as "0012" look numeric but would lose their zeros as numbers"""
+    text = value.strip().lstrip("+-") if isinstance(value, str) else ""
+    return len(text) > 1 and text[0] == "0" and text[1].isdigit()
+
+
+def _text(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class _ColumnType:
+    """A column's type, inferred from its values one chunk at a time"""
+
+    def __init__(self):
+        self.int = self.float = self.datetime = True
+        self.present = 0
+        self.missing = 0
+        self.categories = set()
+
+    def update(self, values):
+        present = [value for value in values if not _missing(value)]
+        self.present += len(present)
+        self.missing += len(values) - len(present)
+        self.categories.update(_text(value) for value in present)
+        if any(isinstance(value, (bool, dict, list)) or _leading_zero(value) for value in present):
+            self.int = self.float = self.datetime = False
+        for kind, parse in (("int", _parse_int), ("float", float)):
+            if getattr(self, kind):
+                try:
+                    for value in present:
+                        parse(value)
+                except (TypeError, ValueError):
+                    setattr(self, kind, False)
+        if self.datetime:
+            try:
+                if not all(isinstance(value, str) and value[:1].isdigit() for value in present):
+                    raise ValueError("not a date")
+                for value in present:
+                    np.datetime64(value.strip(), "s")
+            except ValueError:
+                self.datetime = False
+
+    @property
+    def kind(self):
+        if not self.present:
+            return "string"
+        if self.int and not self.missing:
+            return "int"
+        if self.int or self.float:
+            return "float"
+        return "datetime" if self.datetime else "string"
+
+
+def _encode(kind, values, codes=None):
+    """Convert one chunk of a column's values to its NumPy representation"""
+    if kind == "int":
+        return np.array([int(value) for value in values], dtype=np.int64)
+    if kind == "float":
+        return np.array([np.nan if _missing(value) else float(value) for value in values], dtype=np.float64)
+    if kind == "datetime":
+        return np.array([np.datetime64("NaT") if _missing(value) else np.datetime64(value.strip(), "s")
+                         for value in values], dtype="datetime64[s]")
+    # Strings are dictionary-encoded; -1 marks a missing value
+    return np.array([-1 if _missing(value) else codes[_text(value)] for value in values], dtype=np.int32)
+
+
+_DTYPES = {"int": np.int64, "float": np.float64, "datetime": "datetime64[s]", "string": np.int32}
+
+
+def table_metadata(schema):
+    """Chroma metadata recording where a document's table lives and what it holds"""
+    return {
+        "table_id": schema["table_id"],
+        "table_rows": schema["rows"],
+        "table_columns": json.dumps([{"name": column["name"], "type": column["kind"]} for column in schema["columns"]])
+    }
+
+
+class Table:
+    """A stored table whose columns are memory-mapped NumPy arrays"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "schema.json"), "r", encoding="utf-8") as f:
+            self.schema = json.load(f)
+        self.rows = self.schema["rows"]
+        self._columns = {column["name"]: column for column in self.schema["columns"]}
+        self._arrays = {}
+        self._categories = {}
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def _column(self, name):
+        if name not in self._columns:
+            raise KeyError(f"Unknown column {name!r}; columns are {self.columns}")
+        return self._columns[name]
+
+    def array(self, name):
+        """The raw column: numbers, datetime64 values or category codes for strings"""
+        if name not in self._arrays:
+            column = self._column(name)
+            self._arrays[name] = np.load(os.path.join(self.directory, f"{column['index']}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    def categories(self, name):
+        if name not in self._categories:
+            column = self._column(name)
+            with open(os.path.join(self.directory, f"{column['index']}.categories.json"), "r", encoding="utf-8") as f:
+                self._categories[name] = json.load(f)
+        return self._categories[name]
+
+    def _scalar(self, name, value):
+        """Convert a filter value to the column's representation"""
+        kind = self._column(name)["kind"]
+        if kind == "string":
+            try:
+                return self.categories(name).index(str(value))
+            except ValueError:
+                return -2  # matches no row
+        if kind == "datetime":
+            return np.datetime64(str(value), "s")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        try:
+            return float(str(value).strip())
+        except ValueError:
+            raise ValueError(f"Column {name!r} is numeric; cannot compare it with {value!r}")
+
+    def mask(self, where=None):
+        """
+        Boolean row mask for {column: value} or {column: {"$gt": value, ...}} filters
+
+        Supported operators are $eq, $ne, $in, and $gt, $gte, $lt, $lte on numeric and
+        datetime columns. Datetime values are ISO strings such as "2023-01-01".
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for name, condition in (where or {}).items():
+            values = self.array(name)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator == "$in":
+                    mask &= np.isin(values, [self._scalar(name, item) for item in operand])
+                    continue
+                if operator in ("$gt", "$gte", "$lt", "$lte") and self._column(name)["kind"] == "string":
+                    raise ValueError(f"{operator} is not supported on string column {name!r}")
+                operand = self._scalar(name, operand)
+                if operator == "$eq":
+                    mask &= values == operand
+                elif operator == "$ne":
+                    mask &= values != operand
+                elif operator == "$gt":
+                    mask &= values > operand
+                elif operator == "$gte":
+                    mask &= values >= operand
+                elif operator == "$lt":
+                    mask &= values < operand
+                elif operator == "$lte":
+                    mask &= values <= operand
+                else:
+                    raise ValueError(f"Unknown operator {operator}")
+        return mask
+
+    def _numbers(self, name):
+        column = self._column(name)
+        if column["kind"] == "string":
+            raise ValueError(f"Column {name!r} holds text and can only be counted")
+        values = self.array(name)
+        if column["kind"] == "datetime":
+            return values.astype(np.float64), ~np.isnat(values)
+        values = values.astype(np.float64)
+        return values, ~np.isnan(values)
+
+    def _group_keys(self, group_by):
+        """Return (keys, labeller) for a column name or "column:year|month|day" for dates"""
+        name, _, part = group_by.partition(":")
+        column = self._column(name)
+        keys = self.array(name)
+        if part:
+            if column["kind"] != "datetime" or part not in _DATE_PARTS:
+                raise ValueError(f"Cannot group {name!r} by {part!r}")
+            keys = keys.astype(_DATE_PARTS[part])
+        if column["kind"] == "string":
+            categories = self.categories(name)
+            return keys, lambda key: categories[key] if key >= 0 else None
+        if column["kind"] == "datetime":
+            return keys, lambda key: None if np.isnat(key) else str(key)
+        return keys, lambda key: key.item()
+
+    def aggregate(self, agg, column=None, group_by=None, where=None):
+        """
+        Compute count, sum, mean, min or max of a column over the rows matching where
+
+        Without group_by a single number is returned; with it, {group value: number}.
+        Missing values are ignored; count without a column counts rows.
+        """
+        if agg not in _AGGREGATES:
+            raise ValueError(f"agg must be one of {_AGGREGATES}")
+        mask = self.mask(where)
+        if column is None:
+            if agg != "count":
+                raise ValueError(f"{agg} needs a column")
+            values, valid = np.zeros(self.rows), np.ones(self.rows, dtype=bool)
+        elif agg == "count" and self._column(column)["kind"] == "string":
+            values, valid = np.zeros(self.rows), self.array(column) >= 0
+        else:
+            values, valid = self._numbers(column)
+        mask &= valid
+        values = values[mask]
+
+        if group_by is None:
+            if agg == "count":
+                return int(mask.sum())
+            if not len(values):
+                return None
+            result = {"sum": np.sum, "mean": np.mean, "min": np.min, "max": np.max}[agg](values).item()
+            return self._output(column, agg, result)
+
+        keys, label = self._group_keys(group_by)
+        groups, inverse = np.unique(np.asarray(keys)[mask], return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(groups))
+        if agg == "count":
+            results = counts
+        elif agg in ("sum", "mean"):
+            results = np.bincount(inverse, weights=values, minlength=len(groups))
+            if agg == "mean":
+                results = results / counts
+        else:
+            results = np.full(len(groups), np.inf if agg == "min" else -np.inf)
+            (np.minimum if agg == "min" else np.maximum).at(results, inverse, values)
+        return {label(key): self._output(column, agg, result.item()) for key, result in zip(groups, results)}
+
+    def _output(self, column, agg, value):
+        if column is not None and agg != "count" and self._column(column)["kind"] == "datetime" and agg != "sum":
+            return str(np.datetime64(int(value), "s"))
+        return value
+
+
+class ColumnarStore:
+    """
+    Tabular uploads (CSV, JSON tables) stored as one NumPy .npy file per column
+
+    Tables are keyed by the source file's content hash and opened memory-mapped, so
+    aggregations run vectorized over the columns without re-parsing the source.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, table_id):
+        return os.path.join(self.root, table_id)
+
+    def has(self, table_id):
+        return os.path.exists(os.path.join(self._directory(table_id), "schema.json"))
+
+    def write(self, path, table_id):
+        """Store the table in a CSV/JSON file and return its schema, or None if it isn't tabular"""
+        directory = self._directory(table_id)
+        if self.has(table_id):
+            return self.open(table_id).schema
+        records = _open_records(path)
+        if records is None:
+            return None
+        names, rows = records
+
+        # First pass infers each column's type and string categories, the second fills
+        # the memory-mapped column files chunk by chunk
+        types = [_ColumnType() for _ in names]
+        row_count = 0
+        for chunk in _chunks(rows()):
+            row_count += len(chunk)
+            for index, column_type in enumerate(types):
+                column_type.update([row[index] if index < len(row) else None for row in chunk])
+
+        staging = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(staging, exist_ok=True)
+        try:
+            columns = []
+            arrays = []
+            codes = []
+            for index, (name, column_type) in enumerate(zip(names, types)):
+                kind = column_type.kind
+                arrays.append(np.lib.format.open_memmap(
+                    os.path.join(staging, f"{index}.npy"), mode="w+", dtype=_DTYPES[kind], shape=(row_count,)
+                ))
+                codes.append(None)
+                if kind == "string":
+                    categories = sorted(column_type.categories)
+                    codes[index] = {value: code for code, value in enumerate(categories)}
+                    with open(os.path.join(staging, f"{index}.categories.json"), "w", encoding="utf-8") as f:
+                        json.dump(categories, f)
+                columns.append({"name": name, "index": index, "kind": kind, "dtype": str(arrays[index].dtype)})
+
+            offset = 0
+            for chunk in _chunks(rows()):
+                for index, column in enumerate(columns):
+                    arrays[index][offset:offset + len(chunk)] = _encode(
+                        column["kind"], [row[index] if index < len(row) else None for row in chunk], codes[index]
+                    )
+                offset += len(chunk)
+            for array in arrays:
+                array.flush()
+            del arrays
+            schema = {"table_id": table_id, "source": os.path.basename(path), "rows": row_count, "columns": columns}
+            with open(os.path.join(staging, "schema.json"), "w", encoding="utf-8") as f:
+                json.dump(schema, f)
+            try:
+                os.rename(staging, directory)
+            except OSError:
+                # Written concurrently by another worker; theirs is identical
+                shutil.rmtree(staging, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return schema
+
+    def ingest(self, path, table_id):
+        """Store a tabular upload and return its Chroma metadata; {} for other files or on failure"""
+        if not path.lower().endswith(TABLE_EXTENSIONS):
+            return {}
+        try:
+            schema = self.write(path, table_id)
+        except (OSError, ValueError, UnicodeDecodeError, csv.Error) as e:
+            print(f"Error storing table {path}: {str(e)}")
+            return {}
+        return table_metadata(schema) if schema else {}
+
+    def open(self, table_id):
+        with self._lock:
+            table = self._tables.get(table_id)
+            if table is None:
+                table = self._tables[table_id] = Table(self._directory(table_id))
+            return table
+
+    def aggregate(self, table_id, agg, column=None, group_by=None, where=None):
+        return self.open(table_id).aggregate(agg, column, group_by, where)
+
+
+_default_store = None
+
+
+def aggregate(table_id, agg, column=None, group_by=None, where=None):
+    """
+    Aggregate a stored table, e.g. aggregate(table_id, "mean", "yield", group_by="field",
+    where={"date": {"$gte": "2023-01-01", "$lt": "2024-01-01"}})
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = ColumnarStore(os.getenv("TABLES_DIR", "./vector_db/tables"))
+    return _default_store.aggregate(table_id, agg, column, group_by, where)
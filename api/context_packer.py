@@ -0,0 +1,135 @@
+import re
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+
+# Context window per model, in tokens
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106-preview": 128000,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+}
+
+
+class TokenCounter:
+    """Counts tokens with the model's tiktoken encoding, or ~4 characters per token without tiktoken"""
+
+    def __init__(self, model="gpt-4"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def truncate(self, text, tokens):
+        """Cut text to at most tokens tokens, at a word boundary where possible"""
+        if self.encoding is not None:
+            encoded = self.encoding.encode(text, disallowed_special=())
+            if len(encoded) <= tokens:
+                return text
+            cut = self.encoding.decode(encoded[:tokens])
+        else:
+            if len(text) <= tokens * 4:
+                return text
+            cut = text[:tokens * 4]
+        space = cut.rfind(" ")
+        return cut[:space] if space > len(cut) // 2 else cut
+
+
+def _shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+class ContextPacker:
+    """
+    Assembles prompt context from ranked passages within a per-model token budget
+
+    Passages are dicts with "text" and "label" and, for stored chunks, "doc_id",
+    "page", "start" and "end" offsets. They are taken in rank order; overlapping
+    chunks of the same document are trimmed, near-duplicates dropped, and the last
+    passage that fits only partially is truncated.
+    """
+
+    def __init__(self, model="gpt-4", context_window=None, answer_reserve=1000, min_passage_tokens=50,
+                 duplicate_threshold=0.8):
+        self.model = model
+        self.context_window = context_window or MODEL_CONTEXT_WINDOWS.get(model, 8192)
+        self.answer_reserve = answer_reserve
+        self.min_passage_tokens = min_passage_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.counter = TokenCounter(model)
+
+    def budget(self, *fixed_texts):
+        """Tokens left for context once the fixed prompt parts and the answer are accounted for"""
+        used = sum(self.counter.count(text) for text in fixed_texts)
+        return max(0, self.context_window - self.answer_reserve - used)
+
+    def _trim_overlap(self, passage, kept):
+        """Drop the leading part of a chunk that repeats the end of an already kept chunk"""
+        if passage.get("doc_id") is None or passage.get("start") is None:
+            return passage["text"]
+        for other in kept:
+            if (other.get("doc_id") == passage["doc_id"] and other.get("page") == passage.get("page")
+                    and other.get("start") is not None and other["start"] <= passage["start"] < other["end"]):
+                overlap = other["end"] - passage["start"]
+                text = passage["text"][overlap:]
+                space = text.find(" ")
+                return text[space + 1:] if 0 <= space < 20 else text
+        return passage["text"]
+
+    def pack(self, passages, budget, separator="\n\n"):
+        """Return (context text, report) for passages packed into budget tokens"""
+        report = {
+            "budget": budget,
+            "used": 0,
+            "passages": len(passages),
+            "kept": 0,
+            "truncated": 0,
+            "duplicates": 0,
+            "dropped": 0,
+            "tokens_dropped": 0
+        }
+        parts, kept, kept_shingles = [], [], []
+        separator_tokens = self.counter.count(separator)
+        for passage in passages:
+            text = self._trim_overlap(passage, kept)
+            shingles = _shingles(text)
+            if not text.strip() or any(
+                len(shingles & seen) / len(shingles | seen) >= self.duplicate_threshold for seen in kept_shingles
+            ):
+                report["duplicates"] += 1
+                continue
+
+            label = passage.get("label")
+            block = f"{label}: {text}" if label else text
+            tokens = self.counter.count(block) + (separator_tokens if parts else 0)
+            remaining = budget - report["used"]
+            if tokens > remaining:
+                if remaining < self.min_passage_tokens:
+                    report["dropped"] += 1
+                    report["tokens_dropped"] += tokens
+                    continue
+                truncated = self.counter.truncate(block, remaining - separator_tokens)
+                report["truncated"] += 1
+                report["tokens_dropped"] += tokens - self.counter.count(truncated)
+                block = truncated
+                tokens = self.counter.count(block) + (separator_tokens if parts else 0)
+
+            parts.append(block)
+            kept.append(passage)
+            kept_shingles.append(shingles)
+            report["used"] += tokens
+            report["kept"] += 1
+        return separator.join(parts), report
@@ -1,16 +1,125 @@
 import os
 import chromadb
-from chromadb.utils import embedding_functions
 from chromadb.config import Settings
+from chromadb.errors import InvalidCollectionException
 import time
+import sqlite3
 import threading
 from datetime import datetime
 import uuid
+from contextlib import contextmanager
+
+from chunking import chunk_pages
+from embedding_cache import CachedEmbeddingFunction
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from index_manifest import IndexManifest, chunk_hash
+from columnar_store import ColumnarStore
+from tracing import span
+from llm_gateway import get_llm_gateway
+
+
+_shared_managers = {}
+_shared_lock = threading.Lock()
+
+
+def get_db_manager(persist_dir="./vector_db"):
+    """Return the process-wide DBManager for persist_dir, creating it on first use"""
+    with _shared_lock:
+        manager = _shared_managers.get(persist_dir)
+        if manager is None:
+            manager = DBManager(persist_dir=persist_dir)
+            _shared_managers[persist_dir] = manager
+        return manager
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def build_where(where=None, file_type=None, filename=None, source=None, uploaded_after=None, uploaded_before=None):
+    """
+    Combine a Chroma where filter with common metadata conditions
+
+    Upload-time bounds take datetimes, ISO strings or epoch seconds and match on the
+    timestamp_epoch that store_data records. Returns None when there is nothing to filter.
+    """
+    conditions = [where] if where else []
+    for key, value in (("file_type", file_type), ("filename", filename), ("source", source)):
+        if isinstance(value, (list, tuple, set)):
+            conditions.append({key: {"$in": list(value)}})
+        elif value is not None:
+            conditions.append({key: value})
+    if uploaded_after is not None:
+        conditions.append({"timestamp_epoch": {"$gte": _epoch(uploaded_after)}})
+    if uploaded_before is not None:
+        conditions.append({"timestamp_epoch": {"$lte": _epoch(uploaded_before)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _stale_collection(error):
+    """Whether error means a collection handle outlived its collection, e.g. deleted by another process"""
+    # Chroma 0.4 raises StopIteration from count() and get() once the collection's segments are gone
+    return isinstance(error, (InvalidCollectionException, StopIteration)) or "does not exist" in str(error)
+
+
+class LiveCollection:
+    """
+    A cached Chroma collection handle that follows its collection by name
+
+    Another process (the Streamlit app, reconcile, bulk_ingest) may delete or recreate a
+    collection behind our cached handle. A call failing because the collection no
+    longer exists re-resolves the handle and is retried once.
+    """
+
+    def __init__(self, manager, name, collection, metadata=None):
+        self._manager = manager
+        self._name = name
+        self._collection = collection
+        self._metadata = metadata
+
+    def _refresh(self):
+        fresh = self._manager._open_collection(self._name, self._metadata)
+        if fresh is None:
+            return False
+        self._collection = fresh
+        self._manager._lexical_synced.discard(self._name)
+        return True
+
+    def __getattr__(self, attribute):
+        value = getattr(self._collection, attribute)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            try:
+                return getattr(self._collection, attribute)(*args, **kwargs)
+            except (ValueError, StopIteration, InvalidCollectionException) as e:
+                if not _stale_collection(e) or not self._refresh():
+                    raise
+            return getattr(self._collection, attribute)(*args, **kwargs)
+
+        return call
+
 
 class DBManager:
-    def __init__(self, persist_dir="./vector_db", sync_interval=300):  # sync every 5 minutes by default
+    def __init__(self, persist_dir="./vector_db", sync_interval=300,  # sync every 5 minutes by default
+                 chunk_size=1500, chunk_overlap=200, embed_batch_size=2048, embed_batch_chars=400000,
+                 query_mode=None):
         self.persist_dir = persist_dir
         self.sync_interval = sync_interval
+
+        # Chunking and batching: chunk sizes are in characters (~4 per token), embedding
+        # batches are capped by the provider's input count and a total size budget
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_chars = embed_batch_chars
         
         # Create persist directory if it doesn't exist
         os.makedirs(persist_dir, exist_ok=True)
@@ -20,34 +129,114 @@ class DBManager:
             path=persist_dir
         )
         
-        # Initialize embedding function
-        self.embedding_function = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model_name="text-embedding-ada-002"
+        # Initialize embedding function, behind a local cache keyed by model and text hash; misses
+        # from concurrent callers are batched into one rate-limited request by the LLM gateway
+        model_name = "text-embedding-ada-002"
+        self.embedding_function = CachedEmbeddingFunction(
+            get_llm_gateway().embedding_function(
+                model_name,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_wait=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 10)) / 1000
+            ),
+            model_name=model_name,
+            path=os.path.join(os.getenv("EMBEDDING_CACHE_DIR", "./cache"), "embeddings.db")
         )
 
+        # Largest number of records Chroma accepts in a single add
+        self.add_batch_size = getattr(self.client, "max_batch_size", 5000)
+
+        # Per-collection write counters, shared on disk by every process using this store
+        self._versions = sqlite3.connect(os.path.join(persist_dir, "collection_versions.db"), check_same_thread=False)
+        self._versions.execute("CREATE TABLE IF NOT EXISTS versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        self._versions.commit()
+        self._versions_lock = threading.Lock()
+
+        # BM25 index kept in sync with every write, for exact-term matches the embeddings miss;
+        # queries use it when RETRIEVAL_MODE (or query_mode) is "lexical" or "hybrid"
+        self.query_mode = query_mode or os.getenv("RETRIEVAL_MODE", "vector")
+        self.lexical_index = LexicalIndex(os.path.join(persist_dir, "lexical_index.db"))
+        self._lexical_synced = set()
+
+        # File hash -> document and chunk hashes, so re-uploads only embed what changed
+        self.manifest = IndexManifest(os.path.join(persist_dir, "index_manifest.db"))
+
+        # Columns of tabular uploads as memory-mapped arrays, for aggregations without re-parsing
+        self.tables = ColumnarStore(os.getenv("TABLES_DIR") or os.path.join(persist_dir, "tables"))
+
+        # Resolved collection handles, so operations skip the get_or_create round trip
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+
+        # Cumulative latency per operation, separating Chroma from embedding time
+        self.latency = {}
+        self._latency_lock = threading.Lock()
+
         
     def create_collection(self, name):
         """Create a new collection"""
         try:
-            return self.client.create_collection(
-                name=name,
-                embedding_function=self.embedding_function
-            )
+            with self._timed("chroma.create_collection"):
+                collection = self.client.create_collection(
+                    name=name,
+                    embedding_function=self.embedding_function
+                )
         except Exception as e:
             print(f"Error creating collection {name}: {str(e)}")
             return None
-    
-    def get_collection(self, name):
-        """Get a collection by name or create it if it doesn't exist"""
+        collection = LiveCollection(self, name, collection)
+        with self._collections_lock:
+            self._collections[name] = collection
+        return collection
+
+    def _open_collection(self, name, metadata=None):
         try:
-            return self.client.get_or_create_collection(
-                name=name,
-                embedding_function=self.embedding_function
-            )
+            with self._timed("chroma.get_or_create_collection"):
+                return self.client.get_or_create_collection(
+                    name=name,
+                    metadata=metadata,
+                    embedding_function=self.embedding_function
+                )
         except Exception as e:
             print(f"Error getting or creating collection {name}: {str(e)}")
             return None
+
+    def get_collection(self, name, metadata=None):
+        """Get a collection by name or create it if it doesn't exist"""
+        collection = self._collections.get(name)
+        if collection is not None:
+            return collection
+        collection = self._open_collection(name, metadata)
+        if collection is None:
+            return None
+        collection = LiveCollection(self, name, collection, metadata)
+        with self._collections_lock:
+            self._collections[name] = collection
+        return collection
+
+    def invalidate_collection(self, name):
+        """Forget a cached collection handle, e.g. after it was changed by another process"""
+        with self._collections_lock:
+            self._collections.pop(name, None)
+        self._lexical_synced.discard(name)
+
+    def delete_collection(self, name):
+        """Delete a collection with its lexical index entries"""
+        self.invalidate_collection(name)
+        with self._timed("chroma.delete_collection"):
+            self.client.delete_collection(name=name)
+        self.lexical_index.drop(name)
+        self.manifest.drop(name)
+        self._bump_version(name)
+
+    def rename_collection(self, name, new_name):
+        collection = self.get_collection(name)
+        self.invalidate_collection(name)
+        with self._timed("chroma.modify"):
+            collection.modify(name=new_name)
+        self.lexical_index.rename(name, new_name)
+        self.manifest.rename(name, new_name)
+        self._bump_version(name)
+        self._bump_version(new_name)
     
     def list_collections(self):
         """List all collections"""
@@ -57,32 +246,349 @@ class DBManager:
             print(f"Error listing collections: {str(e)}")
             return []
     
+    def collection_version(self, name):
+        """Number of writes made to a collection so far; caches derived from it compare against this"""
+        with self._versions_lock:
+            row = self._versions.execute("SELECT version FROM versions WHERE collection = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, name):
+        with self._versions_lock:
+            self._versions.execute(
+                "INSERT INTO versions VALUES (?, 1) ON CONFLICT(collection) DO UPDATE SET version = version + 1",
+                (name,)
+            )
+            self._versions.commit()
+
+    @contextmanager
+    def _timed(self, operation):
+        """Time an operation into latency_stats and as a "db." span of the current trace"""
+        started = time.perf_counter()
+        try:
+            with span(f"db.{operation}") as current:
+                yield current
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._latency_lock:
+                entry = self.latency.setdefault(operation, {"count": 0, "seconds": 0.0})
+                entry["count"] += 1
+                entry["seconds"] += elapsed
+
+    def latency_stats(self):
+        """Call count, total and mean milliseconds per operation"""
+        with self._latency_lock:
+            return {
+                operation: {
+                    "count": entry["count"],
+                    "total_ms": round(entry["seconds"] * 1000, 3),
+                    "mean_ms": round(entry["seconds"] * 1000 / entry["count"], 3)
+                }
+                for operation, entry in self.latency.items()
+            }
+
     def sync_to_disk(self):
         """Force a sync of the database to disk - no longer needed as ChromaDB handles this automatically"""
         pass 
 
 
-    def store_data(self,collection_name, content, metadata= {}):
+    def store_data(self, collection_name, content, metadata=None, chunk_size=None, chunk_overlap=None, doc_id=None):
+        """
+        Chunk content, embed the chunks in batches and store them under one document id
+
+        content is either a string or an iterable of page strings; each chunk carries the
+        document metadata plus its chunk index, page and character offsets. Returns the document id.
+        """
+        return self.store_many(collection_name, [(content, metadata)], chunk_size, chunk_overlap,
+                               doc_ids=[doc_id] if doc_id else None)[0]
+
+    def store_many(self, collection_name, documents, chunk_size=None, chunk_overlap=None, doc_ids=None):
+        """
+        Store several (content, metadata) documents, sharing embedding batches and bulk adds
+
+        Returns the document ids in input order.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else self.chunk_overlap
+        return self.store_chunks(
+            collection_name,
+            ((chunk_pages(content, chunk_size, chunk_overlap), metadata) for content, metadata in documents),
+            doc_ids
+        )
+
+    def store_chunks(self, collection_name, documents, doc_ids=None, upsert=False):
+        """
+        Store (chunks, metadata) documents whose content was already chunked with chunk_pages
+
+        With upsert, storing a document id again overwrites its chunks instead of
+        being ignored, so interrupted bulk loads can be retried. Returns the document ids.
+        """
+        collection = self.get_collection(collection_name)
+        stored_ids = []
+
+        def entries():
+            for index, (chunks, metadata) in enumerate(documents):
+                # Add common metadata
+                metadata = dict(metadata or {})
+                metadata.update({
+                    "timestamp": datetime.now().isoformat(),
+                    "timestamp_epoch": time.time(),
+                    "id": (doc_ids[index] if doc_ids else None) or str(uuid.uuid4())
+                })
+                stored_ids.append(metadata["id"])
+                for chunk in chunks:
+                    yield chunk, metadata
+
+        # Store in ChromaDB, one bulk add per add_batch_size chunks
+        try:
+            batch = []
+            for entry in entries():
+                batch.append(entry)
+                if len(batch) >= self.add_batch_size:
+                    self._add_chunks(collection, batch, upsert=upsert)
+                    batch = []
+            if batch:
+                self._add_chunks(collection, batch, upsert=upsert)
+        finally:
+            self._bump_version(collection_name)
+
+        return stored_ids
+
+    def embed(self, texts):
+        """Embed texts in batches sized to the embedding provider's limits"""
+        embeddings = []
+        batch, batch_chars = [], 0
+        for text in texts:
+            if batch and (len(batch) >= self.embed_batch_size or batch_chars + len(text) > self.embed_batch_chars):
+                with self._timed("embedding") as timed:
+                    timed.set(inputs=len(batch), chars=batch_chars)
+                    embeddings.extend(self.embedding_function(batch))
+                batch, batch_chars = [], 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            with self._timed("embedding") as timed:
+                timed.set(inputs=len(batch), chars=batch_chars)
+                embeddings.extend(self.embedding_function(batch))
+        return embeddings
+
+    def _add_chunks(self, collection, entries, ids=None, upsert=False):
+        """Add (chunk, document metadata) pairs with one collection.add (or upsert)"""
+        documents = [chunk["text"] for chunk, _ in entries]
+        ids = ids or [f"{metadata['id']}-{chunk['chunk_index']}" for chunk, metadata in entries]
+        embeddings = self.embed(documents)
+        with self._timed("chroma.upsert" if upsert else "chroma.add"):
+            (collection.upsert if upsert else collection.add)(
+                documents=documents,
+                embeddings=embeddings,
+                metadatas=[
+                    {**metadata, **{key: value for key, value in chunk.items() if key != "text"}}
+                    for chunk, metadata in entries
+                ],
+                ids=ids
+            )
+        with self._timed("lexical.add"):
+            self.lexical_index.add(collection.name, ids, documents, [metadata["id"] for _, metadata in entries])
+
+    def index_document(self, collection_name, key, content, metadata=None, content_hash=None, doc_id=None,
+                       local_path=None, chunk_size=None, chunk_overlap=None):
+        """
+        Store a file under its document key, embedding only chunks that aren't stored yet
+
+        A key indexed before keeps its document id: if the file hash is unchanged nothing
+        is written; otherwise chunks whose text is already stored only get their metadata
+        refreshed, new chunks are embedded and added, and chunks that no longer occur are
+        deleted. Returns {"doc_id", "unchanged", "kept", "added", "deleted"}.
+        """
         collection = self.get_collection(collection_name)
+        chunk_size = chunk_size or self.chunk_size
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else self.chunk_overlap
 
-        # Add common metadata
+        previous = self.manifest.get(collection_name, key)
+        if previous and content_hash and previous["content_hash"] == content_hash:
+            return {"doc_id": previous["doc_id"], "unchanged": True, "kept": 0, "added": 0, "deleted": 0}
+        doc_id = previous["doc_id"] if previous else (doc_id or str(uuid.uuid4()))
+        revision = previous["revision"] + 1 if previous else 0
+
+        metadata = dict(metadata or {})
         metadata.update({
             "timestamp": datetime.now().isoformat(),
-            "id": str(uuid.uuid4())
+            "timestamp_epoch": time.time(),
+            "id": doc_id,
+            "document_key": key
         })
-        
-        # Store in ChromaDB
-        collection.add(
-            documents=[content],
-            metadatas=[metadata],
-            ids=[metadata["id"]]
-        )
+        if content_hash:
+            metadata["content_hash"] = content_hash
+
+        stored = {}
+        for chunk_id, hash in self.manifest.chunks(collection_name, doc_id):
+            stored.setdefault(hash, []).append(chunk_id)
+
+        kept_ids, kept_metadatas, added, added_ids, recorded = [], [], [], [], []
+        stats = {"doc_id": doc_id, "unchanged": False, "kept": 0, "added": 0, "deleted": 0}
+
+        def flush_added():
+            if added:
+                self._add_chunks(collection, added, added_ids, upsert=True)
+                stats["added"] += len(added)
+                added.clear()
+                added_ids.clear()
+
+        def flush_kept():
+            if kept_ids:
+                with self._timed("chroma.update"):
+                    collection.update(ids=kept_ids, metadatas=kept_metadatas)
+                stats["kept"] += len(kept_ids)
+                kept_ids.clear()
+                kept_metadatas.clear()
+
+        try:
+            for chunk in chunk_pages(content, chunk_size, chunk_overlap):
+                hash = chunk_hash(chunk["text"])
+                if stored.get(hash):
+                    chunk_id = stored[hash].pop()
+                    kept_ids.append(chunk_id)
+                    kept_metadatas.append({**metadata, **{name: value for name, value in chunk.items() if name != "text"}})
+                    if len(kept_ids) >= self.add_batch_size:
+                        flush_kept()
+                else:
+                    # Revisions get their own ids so new chunks never collide with kept ones
+                    chunk_id = f"{doc_id}-{chunk['chunk_index']}" if revision == 0 else f"{doc_id}-r{revision}-{chunk['chunk_index']}"
+                    added.append((chunk, metadata))
+                    added_ids.append(chunk_id)
+                    if len(added) >= self.add_batch_size:
+                        flush_added()
+                recorded.append((chunk_id, hash))
+            flush_added()
+            flush_kept()
+
+            stale = [chunk_id for chunk_ids in stored.values() for chunk_id in chunk_ids]
+            for start in range(0, len(stale), self.add_batch_size):
+                with self._timed("chroma.delete"):
+                    collection.delete(ids=stale[start:start + self.add_batch_size])
+            if stale:
+                with self._timed("lexical.delete"):
+                    self.lexical_index.delete(collection_name, stale)
+            stats["deleted"] = len(stale)
 
-    def query_data(self, collection_name, query, n_results=5):
+            self.manifest.record(collection_name, key, content_hash or "", doc_id, local_path, revision, recorded)
+        finally:
+            self._bump_version(collection_name)
+        return stats
+
+    def query_data(self, collection_name, query, n_results=5, mode=None, where=None, include=None,
+                   file_type=None, filename=None, source=None, uploaded_after=None, uploaded_before=None):
+        """
+        Retrieve the chunks most relevant to one or more queries, in Chroma's result layout
+
+        query is a string or a list of strings answered in one call; results hold one list
+        per query. mode is "vector" (embeddings only), "lexical" (BM25 only, no embedding
+        call) or "hybrid", which runs both and merges them with reciprocal-rank fusion.
+        Results can be narrowed with a Chroma where filter and/or the file_type, filename,
+        source and upload-time shortcuts; include selects which of documents, metadatas
+        and distances are returned.
+        """
+        queries = [query] if isinstance(query, str) else list(query)
+        include = list(include) if include is not None else ["documents", "metadatas", "distances"]
+        where = build_where(where, file_type=file_type, filename=filename, source=source,
+                            uploaded_after=uploaded_after, uploaded_before=uploaded_before)
+        mode = mode or self.query_mode
         collection = self.get_collection(collection_name)
-        return collection.query(query_texts=[query], n_results=n_results, include=["documents", "metadatas", "distances"])
+        if mode == "vector":
+            query_embeddings = self.embed(queries)
+            with self._timed("chroma.query"):
+                return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, include=include)
+
+        self._sync_lexical(collection)
+        # Each retriever contributes a deeper list than requested so fusion has candidates;
+        # filtered lexical candidates are checked against Chroma, so fetch more of them
+        candidates = n_results * 3
+        with self._timed("lexical.search"):
+            lexical = [
+                [chunk_id for chunk_id, _ in self.lexical_index.search(collection.name, text, candidates * (4 if where else 1))]
+                for text in queries
+            ]
+        known = {}
+        lexical_ids = list({chunk_id for ranking in lexical for chunk_id in ranking})
+        if where and lexical_ids:
+            with self._timed("chroma.get"):
+                allowed = collection.get(ids=lexical_ids, where=where, include=["documents", "metadatas"])
+            for chunk_id, document, metadata in zip(allowed["ids"], allowed["documents"], allowed["metadatas"]):
+                known[chunk_id] = (document, metadata, None)
+            lexical = [[chunk_id for chunk_id in ranking if chunk_id in known] for ranking in lexical]
+
+        if mode == "lexical":
+            rankings = [[(chunk_id, None) for chunk_id in ranking[:n_results]] for ranking in lexical]
+            return self._fetch_ranked(collection, rankings, known, include)
+
+        query_embeddings = self.embed(queries)
+        with self._timed("chroma.query"):
+            vector = collection.query(query_embeddings=query_embeddings, n_results=candidates, where=where,
+                                      include=["documents", "metadatas", "distances"])
+        rankings = []
+        for index, ranking in enumerate(lexical):
+            for chunk_id, document, metadata, distance in zip(
+                vector["ids"][index], vector["documents"][index], vector["metadatas"][index], vector["distances"][index]
+            ):
+                known[chunk_id] = (document, metadata, distance)
+            rankings.append(reciprocal_rank_fusion([vector["ids"][index], ranking])[:n_results])
+        return self._fetch_ranked(collection, rankings, known, include)
+
+    def _fetch_ranked(self, collection, rankings, known, include):
+        """Build a query result for per-query lists of (id, score), fetching chunks not already at hand"""
+        if "documents" in include or "metadatas" in include:
+            missing = list({chunk_id for ranked in rankings for chunk_id, _ in ranked if chunk_id not in known})
+            if missing:
+                with self._timed("chroma.get"):
+                    fetched = collection.get(ids=missing, include=["documents", "metadatas"])
+                for chunk_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                    known[chunk_id] = (document, metadata, None)
+            rankings = [[(chunk_id, score) for chunk_id, score in ranked if chunk_id in known] for ranked in rankings]
+
+        def field(position):
+            return [[known.get(chunk_id, (None, None, None))[position] for chunk_id, _ in ranked] for ranked in rankings]
+
+        return {
+            "ids": [[chunk_id for chunk_id, _ in ranked] for ranked in rankings],
+            "documents": field(0) if "documents" in include else None,
+            "metadatas": field(1) if "metadatas" in include else None,
+            "distances": field(2) if "distances" in include else None,
+            "scores": [[score for _, score in ranked] for ranked in rankings]
+        }
+
+    def _sync_lexical(self, collection, page_size=1000):
+        """Index chunks written before the lexical index existed, once per collection per process"""
+        if collection.name in self._lexical_synced:
+            return
+        if self.lexical_index.count(collection.name) < collection.count():
+            self.lexical_index.drop(collection.name)
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    break
+                self.lexical_index.add(
+                    collection.name,
+                    page["ids"],
+                    [document or "" for document in page["documents"]],
+                    [(metadata or {}).get("id") for metadata in page["metadatas"]]
+                )
+                offset += page_size
+        self._lexical_synced.add(collection.name)
     
     def delete_data(self, collection_name, id):
+        """Delete a stored document and all of its chunks"""
+        self.delete_many(collection_name, [id])
+
+    def delete_many(self, collection_name, ids):
+        """Delete several stored documents and their chunks with one Chroma call"""
+        if not ids:
+            return
         collection = self.get_collection(collection_name)
-        collection.delete(ids=[id])
+        with self._timed("chroma.delete"):
+            collection.delete(where={"id": {"$in": list(ids)}} if len(ids) > 1 else {"id": ids[0]})
+        with self._timed("lexical.delete"):
+            for id in ids:
+                self.lexical_index.delete_document(collection_name, id)
+        self.manifest.remove_documents(collection_name, ids)
+        self._bump_version(collection_name)
 
@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from chromadb.api.types import EmbeddingFunction
+
+from tracing import span
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function wrapper that caches vectors by model name and normalized text hash
+
+    Vectors are kept as float32 blobs in SQLite with a bounded in-memory LRU in front;
+    only texts missing from both layers are sent to the wrapped function, in one call.
+    A text another caller is already embedding is waited for rather than sent again.
+    """
+
+    def __init__(self, embedding_function, model_name, path="./cache/embeddings.db", memory_items=10000):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.path = path
+        self.memory_items = memory_items
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._inflight = {}  # key -> Future of the vector, while a caller is embedding it
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text):
+        normalized = re.sub(r"\s+", " ", text).strip()
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def __call__(self, input):
+        with span("embedding_cache", inputs=len(input)) as lookup:
+            return self._embed(input, lookup)
+
+    def _embed(self, input, lookup):
+        keys = [self._key(text) for text in input]
+        vectors = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[key] = self._memory[key]
+                    self.memory_hits += 1
+
+            pending = [key for key in dict.fromkeys(keys) if key not in vectors]
+            for start in range(0, len(pending), 500):
+                batch = pending[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    vectors[key] = vector.tolist()
+                    self._remember(key, vectors[key])
+                    self.disk_hits += 1
+
+        # Embed each missing text once, even if it appears several times in input or
+        # is being embedded by a concurrent call
+        missing, waiting = {}, {}
+        with self._lock:
+            for key, text in zip(keys, input):
+                if key in vectors or key in missing or key in waiting:
+                    continue
+                if key in self._memory:
+                    vectors[key] = self._memory[key]  # stored by a call that finished meanwhile
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                else:
+                    missing[key] = text
+                    self._inflight[key] = Future()
+            self.coalesced += len(waiting)
+        lookup.set(cache_hit=not missing and not waiting, embedded=len(missing), coalesced=len(waiting))
+        if missing:
+            self.misses += len(missing)
+            try:
+                embedded = self.embedding_function(list(missing.values()))
+                if len(embedded) != len(missing):
+                    raise ValueError(f"Embedding function returned {len(embedded)} vectors for {len(missing)} texts")
+            except BaseException as e:
+                with self._lock:
+                    for key in missing:
+                        self._inflight.pop(key).set_exception(e)
+                raise
+            with self._lock:
+                for key, vector in zip(missing, embedded):
+                    vector = [float(value) for value in vector]
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                    self._inflight.pop(key).set_result(vector)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    [(key, array("f", vectors[key]).tobytes()) for key in missing]
+                )
+                self._conn.commit()
+        for key, future in waiting.items():
+            vectors[key] = future.result()
+
+        return [vectors[key] for key in keys]
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "stored": stored
+        }
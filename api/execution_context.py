@@ -0,0 +1,158 @@
+import json
+import time
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+
+_current_execution = contextvars.ContextVar("query_execution", default=None)
+_current_node = contextvars.ContextVar("query_execution_node", default=None)
+_ancestor_keys = contextvars.ContextVar("query_execution_ancestors", default=())
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def current_execution():
+    """The QueryExecution of the request being solved in this context, if any"""
+    return _current_execution.get()
+
+
+class QueryExecution:
+    """
+    Request-scoped state shared by a top-level solve_query and all of its sub-queries
+
+    Tracks the sub-query tree and enforces depth, sub-query count, LLM call, token and
+    wall-clock budgets. Identical sub-prompts within the request are solved once.
+    """
+
+    def __init__(self, prompt, max_depth=3, max_subqueries=20, max_llm_calls=40, max_tokens=400000, time_budget=300):
+        self.max_depth = max_depth
+        self.max_subqueries = max_subqueries
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.started = time.monotonic()
+        self.deadline = self.started + time_budget
+
+        self.llm_calls = 0
+        self.tokens = 0
+        self.subqueries = 0
+        self.root = {"prompt": prompt, "depth": 0, "children": []}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # One thread per admitted sub-query at most, so parents waiting on children can't starve the pool
+        self._executor = None
+
+    def activate(self):
+        """Make this the current execution; returns tokens for deactivate()"""
+        return _current_execution.set(self), _current_node.set(self.root)
+
+    def deactivate(self, tokens):
+        execution_token, node_token = tokens
+        _current_node.reset(node_token)
+        _current_execution.reset(execution_token)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def check(self):
+        """Raise BudgetExceeded if the request has run out of time, LLM calls or tokens"""
+        if time.monotonic() > self.deadline:
+            raise BudgetExceeded("time budget exhausted")
+        if self.llm_calls >= self.max_llm_calls:
+            raise BudgetExceeded(f"LLM call budget of {self.max_llm_calls} exhausted")
+        if self.tokens >= self.max_tokens:
+            raise BudgetExceeded(f"token budget of {self.max_tokens} exhausted")
+
+    def record_llm_call(self, tokens):
+        with self._lock:
+            self.llm_calls += 1
+            self.tokens += tokens
+
+    def _admit(self, depth):
+        if depth > self.max_depth:
+            raise BudgetExceeded(f"sub-query depth limit of {self.max_depth} reached")
+        with self._lock:
+            if self.subqueries >= self.max_subqueries:
+                raise BudgetExceeded(f"sub-query limit of {self.max_subqueries} reached")
+            self.subqueries += 1
+        self.check()
+
+    def _run_node(self, parent, key, request, solve):
+        node = {"prompt": request["prompt"], "depth": request["depth"], "children": []}
+        with self._lock:
+            parent["children"].append(node)
+        started = time.monotonic()
+        _current_node.set(node)
+        _ancestor_keys.set(_ancestor_keys.get() + (key,))
+        try:
+            self._admit(request["depth"])
+            result = solve(request["prompt"], request["file_paths"], request["depth"])
+            node["status"] = "ok"
+        except BudgetExceeded as e:
+            result = {"result": f"Sub-query not run: {str(e)}", "complete": "False"}
+            node["status"] = "refused"
+        except Exception as e:
+            result = {"result": f"Sub-query failed: {str(e)}", "complete": "False"}
+            node["status"] = "error"
+        node["seconds"] = round(time.monotonic() - started, 4)
+        return result
+
+    def run_subqueries(self, requests, solve):
+        """
+        Solve sibling sub-queries concurrently and return their results in order
+
+        requests are dicts with prompt and file_paths. Their depth is always the calling
+        node's plus one; a depth sent by generated code is ignored. A sub-prompt already
+        being solved in this request attaches to that computation instead of running
+        again, and one that repeats a prompt of its own ancestors is refused.
+        """
+        parent = _current_node.get() or self.root
+        futures = []
+        for request in requests:
+            request = dict(request, depth=parent["depth"] + 1)
+            key = json.dumps([request["prompt"], sorted(request["file_paths"] or [])])
+            if key in _ancestor_keys.get():
+                future = Future()
+                future.set_result({"result": "Sub-query not run: it repeats an enclosing query", "complete": "False"})
+                futures.append(future)
+                continue
+
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is not None:
+                    parent["children"].append({"prompt": request["prompt"], "depth": request["depth"], "deduplicated": True})
+                    futures.append(future)
+                    continue
+                future = self._inflight[key] = Future()
+                run_inline = len(requests) == 1
+                if not run_inline and self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_subqueries, thread_name_prefix="subquery")
+            futures.append(future)
+            future.set_running_or_notify_cancel()
+
+            # Each sub-query runs in a copy of this context so it sees the execution
+            context = contextvars.copy_context()
+            if run_inline:
+                future.set_result(context.run(self._run_node, parent, key, request, solve))
+            else:
+                inner = self._executor.submit(context.run, self._run_node, parent, key, request, solve)
+                inner.add_done_callback(lambda done, future=future: future.set_result(done.result()))
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(0.0, self.deadline - time.monotonic())))
+            except TimeoutError:
+                results.append({"result": "Sub-query not run: time budget exhausted", "complete": "False"})
+        return results
+
+    def summary(self):
+        with self._lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "tokens": self.tokens,
+                "subqueries": self.subqueries,
+                "seconds": round(time.monotonic() - self.started, 4),
+                "tree": json.loads(json.dumps(self.root))
+            }
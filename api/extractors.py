@@ -0,0 +1,75 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+
+TEXT_EXTENSIONS = ('.txt', '.csv', '.json')
+
+
+def _extract_page_range(path, start, stop):
+    """Extract the text of pages [start, stop) - runs in a worker process"""
+    with open(path, "rb") as stream:
+        reader = PyPDF2.PdfReader(stream)
+        return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def iter_pdf_pages(path, reader=None, workers=None, pages_per_task=20, parallel_threshold=100):
+    """
+    Yield the text of each page of a PDF in order
+
+    Small PDFs are parsed in-process with the given reader, which should read from an
+    open file rather than a path so PyPDF2 doesn't buffer the whole file. PDFs with at
+    least parallel_threshold pages are split into page ranges extracted across a process
+    pool, with at most two ranges per worker in flight so memory stays bounded.
+    """
+    if reader is None:
+        with open(path, "rb") as stream:
+            yield from iter_pdf_pages(path, PyPDF2.PdfReader(stream), workers, pages_per_task, parallel_threshold)
+        return
+
+    page_count = len(reader.pages)
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers <= 1 or page_count < parallel_threshold:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    # Spawned, not forked: this runs on the ingest worker thread of a process with other live threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight = []
+        for start, stop in ranges:
+            in_flight.append(executor.submit(_extract_page_range, path, start, stop))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.pop(0).result()
+        for future in in_flight:
+            yield from future.result()
+
+
+def extract_file(path, file_type="", workers=None):
+    """
+    Extract indexable content from a stored upload
+
+    Returns (content, metadata) where content is a string, or a generator of page
+    texts for PDFs, and metadata holds type-specific fields such as page_count.
+    """
+    name = os.path.basename(path)
+    if file_type.startswith('text/') or name.endswith(TEXT_EXTENSIONS):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read(), {}
+    if name.endswith('.pdf'):
+        stream = open(path, "rb")
+        reader = PyPDF2.PdfReader(stream)
+
+        def pages():
+            try:
+                yield from iter_pdf_pages(path, reader, workers=workers)
+            finally:
+                stream.close()
+
+        return pages(), {"page_count": len(reader.pages)}
+    if file_type.startswith('image/'):
+        return f"Binary image file: {name}", {}
+    return f"Binary file: {name}", {}
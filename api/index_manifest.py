@@ -0,0 +1,124 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+
+
+_COPY_SUFFIX = re.compile(r"^(?P<base>.+)_\d+(?P<extension>\.[^.]*)?$")
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_key(filename, existing=()):
+    """
+    Logical name of an uploaded file
+
+    Uploads of a name that's already taken are saved as name_1.ext, name_2.ext, ...;
+    they are versions of the same document when the unsuffixed name is also known.
+    """
+    match = _COPY_SUFFIX.match(filename)
+    if match:
+        original = match.group("base") + (match.group("extension") or "")
+        if original in existing:
+            return original
+    return filename
+
+
+class IndexManifest:
+    """
+    Content-addressed record of what each indexed file contributed to the vector store
+
+    For every (collection, document key) it keeps the file's content hash and document
+    id, and for every document the hash of each stored chunk, so a changed file can be
+    re-indexed by embedding only the chunks that aren't already stored.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                local_path TEXT,
+                revision INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (collection, key)
+            );
+            CREATE INDEX IF NOT EXISTS files_hash ON files (collection, content_hash);
+            CREATE TABLE IF NOT EXISTS chunks (
+                collection TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+            CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (collection, doc_id);
+            """
+        )
+        self._conn.commit()
+
+    def get(self, collection, key):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE collection = ? AND key = ?", (collection, key)).fetchone()
+        return dict(row) if row else None
+
+    def files(self, collection):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM files WHERE collection = ? ORDER BY key", (collection,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def chunks(self, collection, doc_id):
+        """Return [(chunk id, chunk hash)] of a document"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT id, hash FROM chunks WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            )]
+
+    def record(self, collection, key, content_hash, doc_id, local_path, revision, chunks):
+        """Replace a file's entry and its document's chunk list after a successful (re-)index"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection, key, content_hash, doc_id, local_path, revision, datetime.now().isoformat())
+            )
+            self._conn.execute("DELETE FROM chunks WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [(collection, doc_id, chunk_id, hash) for chunk_id, hash in chunks]
+            )
+            self._conn.commit()
+
+    def remove_documents(self, collection, doc_ids):
+        """Forget files whose documents were deleted from the store"""
+        with self._lock:
+            for doc_id in doc_ids:
+                self._conn.execute("DELETE FROM chunks WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+                self._conn.execute("DELETE FROM files WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+            self._conn.commit()
+
+    def doc_ids(self, collection):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT doc_id FROM files WHERE collection = ?", (collection,))}
+
+    def drop(self, collection):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM files WHERE collection = ?", (collection,))
+            self._conn.commit()
+
+    def rename(self, collection, new_name):
+        with self._lock:
+            self._conn.execute("UPDATE chunks SET collection = ? WHERE collection = ?", (new_name, collection))
+            self._conn.execute("UPDATE files SET collection = ? WHERE collection = ?", (new_name, collection))
+            self._conn.commit()
@@ -0,0 +1,282 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import time
+import uuid
+import traceback
+from datetime import datetime
+
+from extractors import extract_file
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestQueue:
+    """Persistent SQLite-backed queue of file ingestion jobs, de-duplicated by content hash"""
+
+    def __init__(self, path="./ingest_queue.db", max_attempts=3, retry_delay=5.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                doc_id TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_hash ON jobs (collection, content_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+        # Other names the same bytes were uploaded under, pointing at the job that indexed them
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS aliases (
+                collection TEXT NOT NULL,
+                name TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                PRIMARY KEY (collection, name)
+            )"""
+        )
+        self._conn.commit()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def find_by_hash(self, content_hash, collection="data_store", document_key=None):
+        """
+        Return the live (not failed) job whose document currently holds this content, if any
+
+        A job for a file with a document_key stops counting once a newer version of the
+        key is queued: re-uploading an older version's bytes must index it again. Given
+        the document_key of an upload, None is also returned when that key has a document
+        of its own with other content, which the upload replaces as its next version.
+        """
+        with self._lock:
+            if document_key is not None:
+                own = self._latest(collection, document_key)
+                if own is not None and own["content_hash"] != content_hash:
+                    return None
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE collection = ? AND content_hash = ? AND status != 'failed' ORDER BY created_at",
+                (collection, content_hash)
+            ).fetchall()
+            for row in rows:
+                key = json.loads(row["metadata"]).get("document_key")
+                if key is None or self._latest(collection, key)["id"] == row["id"]:
+                    return dict(row)
+        return None
+
+    def _latest(self, collection, key):
+        """The newest live job of a document key"""
+        return self._conn.execute(
+            """SELECT * FROM jobs WHERE collection = ? AND json_extract(metadata, '$.document_key') = ?
+               AND status != 'failed' ORDER BY created_at DESC LIMIT 1""",
+            (collection, key)
+        ).fetchone()
+
+    def add_alias(self, job, name):
+        """Record name as another upload of the job's document instead of indexing it again; returns the job"""
+        if name != json.loads(job["metadata"]).get("document_key"):
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)", (job["collection"], name, job["id"]))
+                self._conn.commit()
+        return job
+
+    def aliases(self, job_id):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM aliases WHERE job_id = ? ORDER BY name", (job_id,))]
+
+    def enqueue(self, file_path, file_type="", metadata=None, content_hash=None, collection="data_store"):
+        """
+        Queue a stored file for ingestion and return its job
+
+        If the same bytes were already queued or ingested into the collection, under any
+        name, the existing job is returned instead and nothing is embedded again; the
+        file's document_key is recorded as an alias of it (see find_by_hash). When a new version replaces
+        a document that has aliases, they are queued as documents of their own from the
+        replaced version's file.
+        """
+        content_hash = content_hash or hash_file(file_path)
+        key = (metadata or {}).get("document_key")
+        existing = self.find_by_hash(content_hash, collection, key)
+        if existing:
+            return self.add_alias(existing, key) if key else existing
+
+        now = datetime.now().isoformat()
+        job_id = str(uuid.uuid4())
+        metadata = dict(metadata or {}, content_hash=content_hash)
+        with self._lock:
+            replaced = self._latest(collection, key) if key else None
+            self._conn.execute(
+                """INSERT INTO jobs (id, content_hash, collection, file_path, file_type, metadata, status,
+                                     available_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?)""",
+                (job_id, content_hash, collection, file_path, file_type, json.dumps(metadata), time.time(), now, now)
+            )
+            # The name now has a document of its own
+            if key:
+                self._conn.execute("DELETE FROM aliases WHERE collection = ? AND name = ?", (collection, key))
+            orphaned = []
+            if replaced is not None:
+                orphaned = [row[0] for row in self._conn.execute("SELECT name FROM aliases WHERE job_id = ?", (replaced["id"],))]
+                self._conn.execute("DELETE FROM aliases WHERE job_id = ?", (replaced["id"],))
+            self._conn.commit()
+
+        for name in orphaned:
+            if os.path.exists(replaced["file_path"]):
+                self.enqueue(
+                    replaced["file_path"], replaced["file_type"],
+                    dict(json.loads(replaced["metadata"]), filename=name, document_key=name),
+                    content_hash=replaced["content_hash"], collection=collection
+                )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self):
+        """Atomically take the next due pending job and mark it running"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND available_at <= ? ORDER BY created_at LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), row["id"])
+            )
+            self._conn.commit()
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def report_progress(self, job_id, progress, message=None):
+        self._update(job_id, progress=progress, message=message)
+
+    def complete(self, job_id, doc_id):
+        self._update(job_id, status="done", progress=1.0, doc_id=doc_id, error=None, message=None)
+
+    def fail(self, job_id, error):
+        """Put a failed job back in the queue with a growing delay, or give up after max_attempts"""
+        job = self.get(job_id)
+        if job["attempts"] < self.max_attempts:
+            delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+            self._update(job_id, status="pending", error=error, available_at=time.time() + delay)
+        else:
+            self._update(job_id, status="failed", error=error)
+
+    def forget_documents(self, doc_ids, collection="data_store"):
+        """Drop the jobs of documents removed from the store, so their files can be ingested again"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM aliases WHERE job_id IN (SELECT id FROM jobs WHERE collection = ? AND doc_id = ?)",
+                [(collection, doc_id) for doc_id in doc_ids]
+            )
+            self._conn.executemany(
+                "DELETE FROM jobs WHERE collection = ? AND doc_id = ?", [(collection, doc_id) for doc_id in doc_ids]
+            )
+            self._conn.commit()
+
+    def requeue_interrupted(self):
+        """Return jobs left running by a previous process to the queue"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+            self._conn.commit()
+
+
+def ingest_job(job, db_manager, report_progress=None):
+    """Extract, chunk and embed the file of a queued job; returns the stored document id"""
+    metadata = json.loads(job["metadata"])
+    content, extra_metadata = extract_file(job["file_path"], job["file_type"])
+    metadata.update(extra_metadata)
+    # CSV/JSON tables are also stored column-wise; the entry records where and with which schema
+    metadata.update(db_manager.tables.ingest(job["file_path"], job["content_hash"]))
+
+    page_count = extra_metadata.get("page_count")
+    if report_progress and page_count and not isinstance(content, str):
+        pages = content
+
+        def tracked_pages():
+            for number, text in enumerate(pages, start=1):
+                yield text
+                report_progress(0.95 * number / page_count, f"Indexed page {number}/{page_count}")
+
+        content = tracked_pages()
+
+    # Versions of a known file only embed the chunks that changed; writes are idempotent on retry
+    if metadata.get("document_key"):
+        return db_manager.index_document(
+            job["collection"], metadata["document_key"], content, metadata,
+            content_hash=job["content_hash"], doc_id=job["id"], local_path=job["file_path"]
+        )["doc_id"]
+
+    # A previous attempt may have stored part of the document under the same id
+    if job["attempts"] > 1:
+        db_manager.delete_data(job["collection"], job["id"])
+    return db_manager.store_data(job["collection"], content, metadata, doc_id=job["id"])
+
+
+class IngestWorker(threading.Thread):
+    """Background thread that drains an IngestQueue into a DBManager"""
+
+    def __init__(self, queue, db_manager, poll_interval=1.0):
+        super().__init__(name="ingest-worker", daemon=True)
+        self.queue = queue
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        self.queue.requeue_interrupted()
+        while not self._stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._stopped.wait(self.poll_interval)
+                continue
+            try:
+                doc_id = ingest_job(
+                    job,
+                    self.db_manager,
+                    lambda progress, message=None: self.queue.report_progress(job["id"], progress, message)
+                )
+                self.queue.complete(job["id"], doc_id)
+            except Exception as e:
+                print(f"Error ingesting {job['file_path']}:\n{traceback.format_exc()}")
+                self.queue.fail(job["id"], str(e))
@@ -0,0 +1,204 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+
+
+# Separators inside compound terms such as "f-102" or "sm_03"
+_SEPARATOR = r"[-_./]"
+# Chemical names with a short digit-comma prefix ("2,4-d", "2,4,5-t"); commas elsewhere,
+# as between CSV fields ("f-12,2023,4.5"), separate terms
+_CHEMICAL = r"(?<![a-z0-9,])[0-9]{1,2}(?:,[0-9]{1,2})+-[a-z][a-z0-9]*"
+_TOKEN = re.compile(rf"(?:{_CHEMICAL}|[a-z0-9]+)(?:{_SEPARATOR}[a-z0-9]+)*")
+
+# Terms too common to rank chunks by; they are not looked up at query time
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how in is it its of on or that the "
+    "their there these this those to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased terms for BM25
+
+    Compound identifiers such as field IDs, sensor codes or chemical names
+    ("f-102", "sm_03", "2,4-d") are kept whole and also split into their parts.
+    """
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        terms.append(token)
+        parts = re.split(r"[-_./,]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class LexicalIndex:
+    """
+    SQLite-backed BM25 inverted index over the chunks of each Chroma collection
+
+    Query cost is bounded: stopwords and terms found in more than max_df of the chunks
+    are skipped, and at most max_postings postings (those with the highest term
+    frequency) are read per remaining term.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75, max_df=0.5, max_postings=2000):
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self.max_postings = max_postings
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                doc_id TEXT,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+            CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (collection, doc_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                collection TEXT NOT NULL,
+                term TEXT NOT NULL,
+                id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (collection, term, id)
+            );
+            CREATE INDEX IF NOT EXISTS postings_id ON postings (collection, id);
+            CREATE INDEX IF NOT EXISTS postings_tf ON postings (collection, term, tf DESC);
+            CREATE TABLE IF NOT EXISTS terms (
+                collection TEXT NOT NULL,
+                term TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (collection, term)
+            );
+            """
+        )
+        # Document frequencies for indexes built before the terms table existed
+        if self._conn.execute("SELECT 1 FROM terms LIMIT 1").fetchone() is None:
+            self._conn.execute(
+                "INSERT INTO terms SELECT collection, term, COUNT(*) FROM postings GROUP BY collection, term"
+            )
+        self._conn.commit()
+
+    def add(self, collection, ids, documents, doc_ids=None):
+        doc_ids = doc_ids or [None] * len(ids)
+        chunk_rows, posting_rows = [], []
+        for chunk_id, document, doc_id in zip(ids, documents, doc_ids):
+            counts = Counter(tokenize(document))
+            chunk_rows.append((collection, chunk_id, doc_id, sum(counts.values())))
+            posting_rows.extend((collection, term, chunk_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._remove(collection, ids)
+            self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", chunk_rows)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", posting_rows)
+            self._count_terms(collection, Counter(term for _, term, _, _ in posting_rows), 1)
+            self._conn.commit()
+
+    def _count_terms(self, collection, frequencies, sign):
+        """Add (sign=1) or subtract (sign=-1) chunk counts from the terms' document frequencies"""
+        self._conn.executemany(
+            """INSERT INTO terms VALUES (?, ?, ?)
+               ON CONFLICT (collection, term) DO UPDATE SET df = df + excluded.df""",
+            [(collection, term, sign * count) for term, count in frequencies.items()]
+        )
+        self._conn.execute("DELETE FROM terms WHERE collection = ? AND df <= 0", (collection,))
+
+    def _remove(self, collection, ids):
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            removed = Counter(row[0] for row in self._conn.execute(
+                f"SELECT term FROM postings WHERE collection = ? AND id IN ({placeholders})", (collection, *batch)
+            ))
+            if removed:
+                self._count_terms(collection, removed, -1)
+            self._conn.execute(f"DELETE FROM postings WHERE collection = ? AND id IN ({placeholders})", (collection, *batch))
+            self._conn.execute(f"DELETE FROM chunks WHERE collection = ? AND id IN ({placeholders})", (collection, *batch))
+
+    def delete(self, collection, ids):
+        with self._lock:
+            self._remove(collection, ids)
+            self._conn.commit()
+
+    def delete_document(self, collection, doc_id):
+        """Remove every chunk of a document"""
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM chunks WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            )]
+            self._remove(collection, ids)
+            self._conn.commit()
+
+    def drop(self, collection):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM terms WHERE collection = ?", (collection,))
+            self._conn.commit()
+
+    def rename(self, collection, new_name):
+        with self._lock:
+            self._conn.execute("UPDATE postings SET collection = ? WHERE collection = ?", (new_name, collection))
+            self._conn.execute("UPDATE chunks SET collection = ? WHERE collection = ?", (new_name, collection))
+            self._conn.execute("UPDATE terms SET collection = ? WHERE collection = ?", (new_name, collection))
+            self._conn.commit()
+
+    def count(self, collection):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def search(self, collection, query, n_results=5):
+        """Return [(chunk_id, bm25_score)] for the best matching chunks"""
+        terms = set(tokenize(query)) - STOPWORDS
+        if not terms:
+            return []
+        with self._lock:
+            total, total_length = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE collection = ?", (collection,)
+            ).fetchone()
+            if total == 0:
+                return []
+            average_length = total_length / total
+            placeholders = ",".join("?" * len(terms))
+            document_frequency = dict(self._conn.execute(
+                f"SELECT term, df FROM terms WHERE collection = ? AND term IN ({placeholders})", (collection, *terms)
+            ).fetchall())
+            # Terms in most chunks barely move the ranking but cost the most postings to read;
+            # a query made only of such terms keeps its rarest one
+            selective = {term: df for term, df in document_frequency.items() if df <= self.max_df * total}
+            if not selective and document_frequency:
+                rarest = min(document_frequency, key=document_frequency.get)
+                selective = {rarest: document_frequency[rarest]}
+            rows = []
+            for term in selective:
+                rows.extend(self._conn.execute(
+                    """SELECT p.term, p.id, p.tf, c.length FROM (
+                           SELECT term, id, tf FROM postings WHERE collection = ? AND term = ?
+                           ORDER BY tf DESC LIMIT ?
+                       ) p JOIN chunks c ON c.collection = ? AND c.id = p.id""",
+                    (collection, term, self.max_postings, collection)
+                ).fetchall())
+
+        scores = Counter()
+        for term, chunk_id, tf, length in rows:
+            df = selective[term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length))
+        return scores.most_common(n_results)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked id lists into one ranking by summing 1 / (k + rank)"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return scores.most_common()
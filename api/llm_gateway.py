@@ -0,0 +1,532 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+import openai
+from openai import OpenAI
+
+from tracing import annotate, metrics
+
+
+# Transient failures worth another attempt; anything else is raised to the caller at once
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+# Requests and tokens per minute and concurrent calls per model, unless LLM_LIMITS overrides them
+DEFAULT_LIMITS = {
+    "gpt-4": {"rpm": 500, "tpm": 40000, "concurrency": 32},
+    "text-embedding-ada-002": {"rpm": 3000, "tpm": 1000000, "concurrency": 16},
+    "*": {"rpm": 500, "tpm": 200000, "concurrency": 32},
+}
+
+# Completion tokens assumed when reserving TPM for a chat call; corrected once usage is known
+EXPECTED_COMPLETION_TOKENS = 256
+
+metrics.describe("llm_gateway_wait_seconds", "Time calls spent queued for rate limits or a concurrency slot")
+metrics.describe("llm_gateway_requests_total", "OpenAI API attempts by model and outcome")
+metrics.describe("llm_gateway_retries_total", "Retried OpenAI API attempts by model and reason")
+metrics.describe("llm_gateway_embedding_batches_total", "Embedding API calls made by the micro-batcher")
+metrics.describe("llm_gateway_embedding_requests_total", "Embedding requests merged into those calls")
+metrics.describe("llm_gateway_queue_depth", "Calls waiting for a model's rate limits or a concurrency slot")
+metrics.describe("llm_gateway_in_flight", "OpenAI API calls in progress by model")
+metrics.describe("llm_gateway_rate_per_minute", "Currently admitted requests or tokens per minute by model")
+
+
+class IncompleteResponse(Exception):
+    """A completion that came back cut off or malformed, e.g. JSON that doesn't parse"""
+
+
+class TokenBucket:
+    """
+    Rate limit of amount units per minute with bursts up to capacity
+
+    reserve() takes the units at once, going into debt when the bucket is empty, and
+    returns how long the caller must wait until the debt is paid back; callers are thus
+    spaced out in arrival order. The refill rate adapts: slow_down() after a 429, and
+    speed_up() back towards the configured limit after successes.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.limit = per_minute
+        self.rate = per_minute
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self._lock:
+            self._refill()
+            # A request larger than the whole bucket still goes through, once it is full
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens * 60 / self.rate
+
+    def adjust(self, amount):
+        """Correct an earlier reservation by amount (negative to give units back)"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def slow_down(self, factor=0.5, floor=0.05):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.limit * floor, self.rate * factor)
+
+    def speed_up(self, step=0.02):
+        with self._lock:
+            if self.rate < self.limit:
+                self._refill()
+                self.rate = min(self.limit, self.rate + self.limit * step)
+
+
+class ConcurrencySlots:
+    """Cap on concurrent calls shared by threads and event loops, granted in arrival order"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _take_or_queue(self, wake):
+        with self._lock:
+            if self.in_use < self.limit and not self._waiters:
+                self.in_use += 1
+                return True
+            self._waiters.append(wake)
+            return False
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self):
+        granted = threading.Event()
+        if not self._take_or_queue(granted.set):
+            granted.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        if self._take_or_queue(wake):
+            return
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(wake)
+                    handed_over = False
+                except ValueError:
+                    handed_over = True
+            if handed_over:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.in_use -= 1
+                return
+            # The slot passes straight to the next waiter
+            wake = self._waiters.popleft()
+        wake()
+
+
+class ModelLimiter:
+    """Request and token buckets plus the concurrency cap of one model"""
+
+    def __init__(self, model, rpm, tpm, concurrency):
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.slots = ConcurrencySlots(concurrency)
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Seconds to wait before a call estimated at tokens may start"""
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.reserve(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.reserve(tokens))
+        return max(waits)
+
+    def queue(self, delta):
+        with self._lock:
+            self.queued += delta
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.wait_seconds += seconds
+        metrics.observe("llm_gateway_wait_seconds", seconds, model=self.model)
+
+    def throttled(self):
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.slow_down()
+
+    def succeeded(self, estimated_tokens, used_tokens):
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.speed_up()
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.adjust(used_tokens - estimated_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.queued + self.slots.waiting,
+                "in_flight": self.slots.in_use,
+                "concurrency": self.slots.limit,
+                "rpm": round(self.requests.rate, 1) if self.requests else None,
+                "rpm_limit": self.requests.limit if self.requests else None,
+                "tpm": round(self.tokens.rate, 1) if self.tokens else None,
+                "tpm_limit": self.tokens.limit if self.tokens else None,
+                "calls": self.calls,
+                "mean_wait_ms": round(self.wait_seconds * 1000 / self.calls, 3) if self.calls else 0.0
+            }
+
+
+class LLMGateway:
+    """
+    Process-wide entry point for OpenAI calls
+
+    Every chat completion and embedding request is admitted through its model's
+    request/token buckets and concurrency cap, and retried with jittered exponential
+    backoff on rate limits, timeouts, connection and server errors. A 429 also lowers
+    the model's admitted rate, which recovers gradually as calls succeed. Clients
+    passed in should be created with max_retries=0 so retries aren't compounded.
+    """
+
+    def __init__(self, limits=None, max_retries=5, backoff_base=0.5, backoff_max=30.0):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model):
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limits = self.limits.get(model, self.limits["*"])
+                limiter = self._limiters[model] = ModelLimiter(
+                    model, limits.get("rpm"), limits.get("tpm"), limits.get("concurrency", 32)
+                )
+            return limiter
+
+    def _backoff(self, error, attempt):
+        """Full-jitter exponential delay, at least as long as a Retry-After the API asked for"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            pass
+        return delay
+
+    def _failed(self, limiter, error, attempt):
+        """Account for a failed attempt; returns the delay before retrying, or None to give up"""
+        metrics.inc("llm_gateway_requests_total", model=limiter.model, outcome=type(error).__name__)
+        if isinstance(error, openai.RateLimitError):
+            limiter.throttled()
+        if attempt >= self.max_retries:
+            return None
+        metrics.inc("llm_gateway_retries_total", model=limiter.model, reason=type(error).__name__)
+        annotate(retries=attempt + 1, last_error=type(error).__name__)
+        return self._backoff(error, attempt)
+
+    def _succeeded(self, limiter, estimated_tokens, usage):
+        metrics.inc("llm_gateway_requests_total", model=limiter.model, outcome="ok")
+        limiter.succeeded(estimated_tokens, getattr(usage, "total_tokens", None))
+
+    def _admit(self, limiter, tokens):
+        started = time.perf_counter()
+        limiter.queue(1)
+        try:
+            delay = limiter.reserve(tokens)
+            if delay:
+                time.sleep(delay)
+        finally:
+            limiter.queue(-1)
+        limiter.slots.acquire()
+        waited = time.perf_counter() - started
+        limiter.record_wait(waited)
+        return waited
+
+    async def _aadmit(self, limiter, tokens):
+        started = time.perf_counter()
+        limiter.queue(1)
+        try:
+            delay = limiter.reserve(tokens)
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            limiter.queue(-1)
+        await limiter.slots.aacquire()
+        waited = time.perf_counter() - started
+        limiter.record_wait(waited)
+        return waited
+
+    def run(self, model, tokens, attempt, validate=None, on_retry=None):
+        """
+        Call attempt() -> (result, usage) under the model's limits, retrying transient failures
+
+        validate(result) may raise IncompleteResponse to have a malformed result retried;
+        on_retry() runs before each retry. Returns (result, usage).
+        """
+        limiter = self.limiter(model)
+        queued = 0.0
+        for number in range(self.max_retries + 1):
+            queued += self._admit(limiter, tokens)
+            try:
+                result, usage = attempt()
+                if validate is not None:
+                    validate(result)
+            except (IncompleteResponse,) + RETRYABLE_ERRORS as e:
+                delay = self._failed(limiter, e, number)
+                if delay is None:
+                    raise
+            else:
+                self._succeeded(limiter, tokens, usage)
+                annotate(queued_seconds=round(queued, 4))
+                return result, usage
+            finally:
+                limiter.slots.release()
+            if on_retry is not None:
+                on_retry()
+            time.sleep(delay)
+
+    async def arun(self, model, tokens, attempt, validate=None, on_retry=None):
+        """run() for a coroutine function attempt"""
+        limiter = self.limiter(model)
+        queued = 0.0
+        for number in range(self.max_retries + 1):
+            queued += await self._aadmit(limiter, tokens)
+            try:
+                result, usage = await attempt()
+                if validate is not None:
+                    validate(result)
+            except (IncompleteResponse,) + RETRYABLE_ERRORS as e:
+                delay = self._failed(limiter, e, number)
+                if delay is None:
+                    raise
+            else:
+                self._succeeded(limiter, tokens, usage)
+                annotate(queued_seconds=round(queued, 4))
+                return result, usage
+            finally:
+                limiter.slots.release()
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _estimate(messages):
+        return sum(len(message["content"]) for message in messages) // 4 + EXPECTED_COMPLETION_TOKENS
+
+    @staticmethod
+    def _json_validator(content):
+        try:
+            json.loads(content)
+        except (TypeError, ValueError) as e:
+            raise IncompleteResponse(f"completion is not valid JSON: {str(e)}")
+
+    def chat(self, client, model, messages, on_token=None, on_restart=None, expect_json=False):
+        """
+        One chat completion through the gateway; returns (content, usage)
+
+        With on_token the completion is streamed (usage is then None). If an attempt
+        fails after tokens were streamed, on_restart() runs before the retry streams
+        the answer again. expect_json retries completions that don't parse as JSON.
+        """
+        streamed = []
+
+        def attempt():
+            if on_token is None:
+                response = client.chat.completions.create(model=model, messages=messages)
+                return response.choices[0].message.content, response.usage
+            streamed.clear()
+            started = time.perf_counter()
+            for chunk in client.chat.completions.create(model=model, messages=messages, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not streamed:
+                        annotate(first_token_seconds=round(time.perf_counter() - started, 4))
+                    streamed.append(delta)
+                    on_token(delta)
+            return "".join(streamed), None
+
+        def on_retry():
+            if streamed and on_restart is not None:
+                on_restart()
+
+        return self.run(model, self._estimate(messages), attempt,
+                        validate=self._json_validator if expect_json else None, on_retry=on_retry)
+
+    async def achat(self, client, model, messages, on_token=None, on_restart=None, expect_json=False):
+        """chat() on an AsyncOpenAI client"""
+        streamed = []
+
+        async def attempt():
+            if on_token is None:
+                response = await client.chat.completions.create(model=model, messages=messages)
+                return response.choices[0].message.content, response.usage
+            streamed.clear()
+            started = time.perf_counter()
+            async for chunk in await client.chat.completions.create(model=model, messages=messages, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not streamed:
+                        annotate(first_token_seconds=round(time.perf_counter() - started, 4))
+                    streamed.append(delta)
+                    on_token(delta)
+            return "".join(streamed), None
+
+        def on_retry():
+            if streamed and on_restart is not None:
+                on_restart()
+
+        return await self.arun(model, self._estimate(messages), attempt,
+                               validate=self._json_validator if expect_json else None, on_retry=on_retry)
+
+    def embed(self, client, model, texts):
+        """One embeddings request through the gateway; returns the vectors in input order"""
+
+        def attempt():
+            response = client.embeddings.create(input=texts, model=model)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], response.usage
+
+        return self.run(model, sum(len(text) for text in texts) // 4, attempt)[0]
+
+    def embedding_function(self, model, api_key=None, max_wait=0.01, max_inputs=2048, max_chars=400000):
+        """An embedding function for model whose concurrent calls are merged into batched requests"""
+        return EmbeddingBatcher(self, OpenAI(api_key=api_key, max_retries=0), model,
+                                max_wait=max_wait, max_inputs=max_inputs, max_chars=max_chars)
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.model: limiter.stats() for limiter in limiters}
+
+    def gauges(self):
+        """Queue depth, in-flight calls and admitted rates per model, for the metrics endpoint"""
+        gauges = {}
+        for model, stats in self.stats().items():
+            gauges.setdefault("llm_gateway_queue_depth", []).append(({"model": model}, stats["queued"]))
+            gauges.setdefault("llm_gateway_in_flight", []).append(({"model": model}, stats["in_flight"]))
+            for limit in ("rpm", "tpm"):
+                if stats[limit] is not None:
+                    gauges.setdefault("llm_gateway_rate_per_minute", []).append(
+                        ({"model": model, "limit": limit}, stats[limit])
+                    )
+        return gauges
+
+
+class _Batch:
+    def __init__(self):
+        self.texts = []
+        self.chars = 0
+        self.closed = False
+        self.done = threading.Event()
+        self.vectors = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """
+    Embedding function that merges the requests of concurrent callers into one API call
+
+    The first caller of a batch waits up to max_wait seconds (less once max_inputs texts
+    or max_chars characters have joined) and then embeds the whole batch; every caller
+    gets back its own slice. Failures reach all callers of the batch.
+    """
+
+    def __init__(self, gateway, client, model, max_wait=0.01, max_inputs=2048, max_chars=400000):
+        self.gateway = gateway
+        self.client = client
+        self.model = model
+        self.max_wait = max_wait
+        self.max_inputs = max_inputs
+        self.max_chars = max_chars
+        self._open = None
+        self._full = threading.Condition()
+
+    def _is_full(self, batch):
+        return len(batch.texts) >= self.max_inputs or batch.chars >= self.max_chars
+
+    def __call__(self, input):
+        # Newlines can degrade embedding quality
+        texts = [text.replace("\n", " ") for text in input]
+        chars = sum(len(text) for text in texts)
+        with self._full:
+            batch = self._open
+            leader = (batch is None or batch.closed or len(batch.texts) + len(texts) > self.max_inputs
+                      or batch.chars + chars > self.max_chars)
+            if leader:
+                batch = self._open = _Batch()
+            start = len(batch.texts)
+            batch.texts.extend(texts)
+            batch.chars += chars
+            if not leader and self._is_full(batch):
+                self._full.notify_all()
+            if leader:
+                self._full.wait_for(lambda: self._is_full(batch), timeout=self.max_wait)
+                batch.closed = True
+                if self._open is batch:
+                    self._open = None
+
+        metrics.inc("llm_gateway_embedding_requests_total", model=self.model, role="leader" if leader else "joined")
+        if leader:
+            metrics.inc("llm_gateway_embedding_batches_total", model=self.model)
+            try:
+                batch.vectors = self.gateway.embed(self.client, self.model, batch.texts)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[start:start + len(texts)]
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway():
+    """
+    Return the process-wide LLMGateway
+
+    LLM_LIMITS is a JSON object of per-model {"rpm", "tpm", "concurrency"} overrides
+    ("*" for any other model); LLM_MAX_RETRIES sets the retry count.
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(
+                limits=json.loads(os.getenv("LLM_LIMITS", "{}")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", 5))
+            )
+        return _gateway
@@ -0,0 +1,117 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+
+class PageCache:
+    """Disk-backed key/value cache with TTL expiry, size-bounded LRU eviction and hit/miss counters"""
+
+    def __init__(self, path="./cache/page_cache.db", ttl=86400, max_bytes=200 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidations = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self._conn.commit()
+
+    def lookup(self, key):
+        """
+        Return the cached entry for key as a dict, or None
+
+        The entry carries "fresh" so callers can revalidate stale entries using its
+        etag/last_modified instead of re-downloading.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, etag, last_modified, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        value, etag, last_modified, stored_at = row
+        fresh = time.time() - stored_at < self.ttl
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale += 1
+        return {"value": value, "etag": etag, "last_modified": last_modified, "fresh": fresh}
+
+    def get(self, key):
+        """Return the cached value if present and within TTL"""
+        entry = self.lookup(key)
+        if entry is None or not entry["fresh"]:
+            return None
+        return entry["value"]
+
+    def set(self, key, value, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, value, etag, last_modified, now, now, len(value.encode("utf-8")))
+            )
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """Mark a stale entry as fresh again after a successful revalidation (304)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+            self._conn.commit()
+        self.revalidations += 1
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, value):
+        self.set(key, json.dumps(value))
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "revalidations": self.revalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
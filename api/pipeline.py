@@ -0,0 +1,135 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import span, in_context
+
+
+# Shared by every solver pipeline in the process
+_stage_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="solver-stage")
+
+
+class LoopLocal:
+    """
+    One instance of an async client per event loop
+
+    httpx connection pools belong to the loop that opened them. Under ASGI there is a
+    single loop; when async views run under WSGI each request gets a fresh one, so
+    instances of loops that have since closed are dropped as new loops appear.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            instance = self._instances.get(loop)
+            if instance is None:
+                for closed in [other for other in self._instances if other.is_closed()]:
+                    del self._instances[closed]
+                instance = self._instances[loop] = self.factory()
+            return instance
+
+
+_thread_loops = threading.local()
+
+
+def run_sync(coroutine):
+    """
+    Run a coroutine to completion from synchronous code and return its result
+
+    Each calling thread keeps its own event loop, so the async clients bound to it (see
+    LoopLocal) and their connection pools are reused by that thread's later calls. The
+    coroutine runs in a copy of the caller's context, as asyncio.run would.
+    """
+    loop = getattr(_thread_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _thread_loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+class StageRunner:
+    """Runs the named stages of one solve_query call, inline or in the background, and records their timings and spans"""
+
+    def __init__(self, on_event=None):
+        self.timings = {}
+        self.on_event = on_event
+        self._lock = threading.Lock()
+
+    def _record(self, name, started, status):
+        with self._lock:
+            self.timings[name] = {"seconds": round(time.perf_counter() - started, 4), "status": status}
+            timing = dict(self.timings[name])
+        if self.on_event:
+            self.on_event({"event": "stage", "stage": name, **timing})
+
+    def _timed(self, name, fn, *args, **kwargs):
+        if self.on_event:
+            self.on_event({"event": "stage", "stage": name, "status": "started"})
+        started = time.perf_counter()
+        try:
+            with span(name):
+                result = fn(*args, **kwargs)
+        except Exception:
+            self._record(name, started, "error")
+            raise
+        self._record(name, started, "ok")
+        return result
+
+    async def arun(self, name, fn, *args, **kwargs):
+        """Await a stage: coroutine functions run on the event loop, blocking ones in a worker thread"""
+        if self.on_event:
+            self.on_event({"event": "stage", "stage": name, "status": "started"})
+        started = time.perf_counter()
+        try:
+            with span(name):
+                if asyncio.iscoroutinefunction(fn):
+                    result = await fn(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(fn, *args, **kwargs)
+        except Exception:
+            self._record(name, started, "error")
+            raise
+        self._record(name, started, "ok")
+        return result
+
+    def asubmit(self, name, fn, *args, **kwargs):
+        """Start a stage as a task on the running event loop and return it"""
+        return asyncio.ensure_future(self.arun(name, fn, *args, **kwargs))
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run a stage in the calling thread"""
+        return self._timed(name, fn, *args, **kwargs)
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Start a stage in the background and return its future; its span nests under the caller's"""
+        return _stage_executor.submit(in_context(self._timed), name, fn, *args, **kwargs)
+
+    def cancel(self, name, future, cancel_event=None):
+        """
+        Drop a speculative stage whose result turned out to be unused
+
+        Stages that have not started are cancelled outright; running ones are asked to stop
+        through cancel_event and their result is discarded. Tasks from asubmit are cancelled
+        at their next await.
+        """
+        if cancel_event is not None:
+            cancel_event.set()
+        if future.cancel():
+            with self._lock:
+                self.timings[name] = {"seconds": 0.0, "status": "cancelled"}
+        else:
+            future.add_done_callback(lambda _: self._mark_discarded(name))
+
+    def _mark_discarded(self, name):
+        with self._lock:
+            if name in self.timings:
+                self.timings[name]["status"] = "discarded"
+
+    def report(self):
+        with self._lock:
+            return {name: dict(timing) for name, timing in self.timings.items()}
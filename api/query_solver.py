@@ -1,4 +1,6 @@
+import copy
 import uuid
+import asyncio
 from datetime import datetime
 from system_prompt import UI_PROMPT, TOOL_SEARCH_PROMPT, DATA_SEARCH_PROMPT, WEB_SEARCH_PROMPT
 import json
@@ -6,151 +8,466 @@ import os
 import PyPDF2
 from io import BytesIO
 
-from openai import OpenAI
-from db_manager import DBManager
+from openai import OpenAI, AsyncOpenAI
+from db_manager import DBManager, get_db_manager
 from dotenv import load_dotenv
 from native_tools import invoke_native_tool
 from search_api import SearchAPI
-import traceback
+from pipeline import StageRunner, LoopLocal, run_sync
+from streaming import ResultFieldStreamer
+from answer_cache import SemanticAnswerCache
+from context_packer import ContextPacker
+from sandbox import SandboxPool
+from code_cache import CodeCache
+from execution_context import QueryExecution, current_execution
+from tracing import span
+from single_flight import SingleFlight
+from llm_gateway import get_llm_gateway
+import threading
 
 # Load environment variables
 load_dotenv()
 
+
+_shared_solver = None
+_solver_lock = threading.Lock()
+_solver_state = {"status": "cold", "error": None, "started_at": None, "ready_at": None}
+
+
+def get_query_solver():
+    """Return the process-wide QuerySolver, building it on first use"""
+    global _shared_solver
+    if _shared_solver is not None:
+        return _shared_solver
+    with _solver_lock:
+        if _shared_solver is None:
+            _solver_state.update({"status": "warming", "error": None, "started_at": datetime.now().isoformat()})
+            try:
+                _shared_solver = QuerySolver()
+            except Exception as e:
+                _solver_state.update({"status": "failed", "error": str(e)})
+                raise
+            _solver_state.update({"status": "ready", "ready_at": datetime.now().isoformat()})
+        return _shared_solver
+
+
+def warm_up():
+    """Build the shared solver ahead of the first request, recording failures instead of raising"""
+    try:
+        get_query_solver()
+    except Exception as e:
+        print(f"QuerySolver warm-up failed: {str(e)}")
+
+
+def solver_state():
+    """Snapshot of the shared solver's warm-up state for health checks"""
+    return dict(_solver_state)
+
+
 class QuerySolver:
-    def __init__(self):
+    def __init__(self, client=None, db_manager=None, search_api=None, async_client=None):
         """
         Initialize QuerySolver 
         """
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Retries are left to the LLM gateway, which also paces calls to the rate limits
+        self.client = client or OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.gateway = get_llm_gateway()
+        # AsyncOpenAI for asolve_query; by default one per event loop, pointed where self.client is
+        self.async_client = async_client
+        self._async_clients = LoopLocal(
+            lambda: AsyncOpenAI(api_key=self.client.api_key, base_url=self.client.base_url, max_retries=0)
+        )
         # Initialize database manager (replaces previous ChromaDB initialization)
-        self.db_manager = DBManager(persist_dir="./vector_db")
+        self.db_manager = db_manager or get_db_manager(persist_dir="./vector_db")
         self.data_collection = self.db_manager.get_collection("data_store")
-        self.search_api = SearchAPI(api_key=os.getenv("SEARCH_API_KEY"))
+        self.search_api = search_api or SearchAPI(api_key=os.getenv("SEARCH_API_KEY"))
+        # Overlap the web search with the data-store stages instead of waiting for them
+        self.speculative_search = os.getenv("SPECULATIVE_WEB_SEARCH", "1") != "0"
+        # Token-budgeted context assembly for the gpt-4 prompts
+        self.context_packer = ContextPacker(
+            model="gpt-4",
+            context_window=int(os.getenv("CONTEXT_WINDOW_TOKENS", 0)) or None
+        )
+        # Pre-warmed, resource-limited worker processes for generated code
+        self.sandbox = SandboxPool(
+            size=int(os.getenv("SANDBOX_WORKERS", 2)),
+            cpu_seconds=int(os.getenv("SANDBOX_CPU_SECONDS", 30)),
+            wall_seconds=float(os.getenv("SANDBOX_WALL_SECONDS", 120)),
+            max_rss_bytes=int(os.getenv("SANDBOX_MAX_RSS_MB", 1024)) * 1024 * 1024,
+            max_overflow=int(os.getenv("SANDBOX_MAX_OVERFLOW", 2))
+        )
+        # Validated generated snippets, reused for tasks with the same signature
+        self.code_cache = CodeCache(self.db_manager) if os.getenv("CODE_CACHE", "1") != "0" else None
+        # Answers to earlier, near-identical prompts against the same data_store version
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE", "1") != "0":
+            self.answer_cache = SemanticAnswerCache(
+                self.db_manager,
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+            )
+        # Identical top-level queries arriving while one is being solved share its answer
+        self.query_flight = SingleFlight("queries") if os.getenv("COALESCE_QUERIES", "1") != "0" else None
+
 
 
+    def solve_query(self, prompt, file_paths=[], depth = 0, on_event=None):
+        """
+        Process query with optional file context
 
-    def solve_query(self, prompt, file_paths=[], depth = 0):
-        """Process query with optional file context"""
+        on_event, if given, receives stage progress events and, for the top-level query,
+        the tokens of the answer as they are generated. A top-level query opens a
+        QueryExecution whose budgets are shared by all of its nested sub-queries.
 
-        
-        # Query the data store
-        results = self.db_manager.query_data("data_store", prompt, 5)
-        
-        # Prepare context
-        context_items = []
+        A top-level query identical to one already in flight (same prompt, files and
+        data_store version) waits for that one's answer instead of running again.
+        Streamed queries are always run on their own.
+
+        This runs the same pipeline as asolve_query, on an event loop kept for the
+        calling thread.
+        """
+        if self.query_flight is not None and depth == 0 and on_event is None and current_execution() is None:
+            result, shared = self.query_flight.do(
+                self._query_key(prompt, file_paths), self._solve_spanned, prompt, file_paths, depth, None
+            )
+            return self._own_copy(result, shared)
+        return self._solve_spanned(prompt, file_paths, depth, on_event)
+
+    def _solve_spanned(self, prompt, file_paths, depth, on_event):
+        with span("solve_query", depth=depth, prompt_chars=len(prompt)) as query:
+            response_json = self._solve_in_execution(prompt, file_paths, depth, on_event)
+            if isinstance(response_json, dict):
+                query.set(cached=bool(response_json.get("cached")), complete=response_json.get("complete"))
+            return response_json
+
+    async def asolve_query(self, prompt, file_paths=[], on_event=None):
+        """
+        Top-level solve_query for async callers
+
+        The GPT-4 calls and the web search are awaited on the event loop, so a waiting
+        query holds no thread; Chroma, context packing and generated code still block and
+        run in worker threads. Sub-queries issued by generated code go through solve_query
+        from that thread. on_event may be called from those threads too.
+        Identical queries are coalesced as in solve_query.
+        """
+        if self.query_flight is not None and on_event is None:
+            result, shared = await self.query_flight.ado(
+                self._query_key(prompt, file_paths), self._asolve_spanned, prompt, file_paths, None
+            )
+            return self._own_copy(result, shared)
+        return await self._asolve_spanned(prompt, file_paths, on_event)
+
+    async def _asolve_spanned(self, prompt, file_paths, on_event):
+        with span("solve_query", depth=0, prompt_chars=len(prompt), asynchronous=True) as query:
+            execution = self._new_execution(prompt)
+            tokens = execution.activate()
+            try:
+                response_json = await self._asolve_query(prompt, file_paths, 0, on_event)
+            finally:
+                execution.deactivate(tokens)
+            if isinstance(response_json, dict):
+                if not response_json.get("cached"):
+                    response_json["execution"] = execution.summary()
+                query.set(cached=bool(response_json.get("cached")), complete=response_json.get("complete"))
+            return response_json
+
+    def _query_key(self, prompt, file_paths):
+        return json.dumps([prompt, sorted(file_paths or []), self.db_manager.collection_version("data_store")])
+
+    @staticmethod
+    def _own_copy(result, shared):
+        """Every caller of a coalesced query gets its own copy of the answer, marked if it was shared"""
+        result = copy.deepcopy(result)
+        if shared and isinstance(result, dict):
+            result["coalesced"] = True
+        return result
+
+    @staticmethod
+    def _new_execution(prompt):
+        return QueryExecution(
+            prompt,
+            max_depth=int(os.getenv("MAX_QUERY_DEPTH", 3)),
+            max_subqueries=int(os.getenv("MAX_SUBQUERIES", 20)),
+            max_llm_calls=int(os.getenv("MAX_LLM_CALLS", 40)),
+            max_tokens=int(os.getenv("MAX_QUERY_TOKENS", 400000)),
+            time_budget=float(os.getenv("QUERY_TIME_BUDGET", 300))
+        )
+
+    def _solve_in_execution(self, prompt, file_paths, depth, on_event):
+        if depth != 0 or current_execution() is not None:
+            return run_sync(self._asolve_query(prompt, file_paths, depth, on_event))
+
+        execution = self._new_execution(prompt)
+        tokens = execution.activate()
+        try:
+            response_json = run_sync(self._asolve_query(prompt, file_paths, depth, on_event))
+        finally:
+            execution.deactivate(tokens)
+        if isinstance(response_json, dict) and not response_json.get("cached"):
+            response_json["execution"] = execution.summary()
+        return response_json
+
+    @staticmethod
+    def _data_passages(results):
+        passages = []
         for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-            context_items.append(f"From {meta.get('id', 'Unknown')}: {doc}")
-        
-        context = "\n\n".join(context_items)
+            label = f"From {meta.get('id', 'Unknown')}"
+            if meta.get('table_id'):
+                # Tabular sources can be aggregated directly in generated code
+                label += f" (table_id {meta['table_id']}, {meta.get('table_rows')} rows, columns {meta.get('table_columns')})"
+            passages.append({
+                "text": doc,
+                "label": label,
+                "doc_id": meta.get('id'),
+                "page": meta.get('page'),
+                "start": meta.get('start_offset'),
+                "end": meta.get('end_offset')
+            })
+        return passages
+
+    @staticmethod
+    def _web_passages(search_results):
+        return [
+            {"text": result['content'], "label": f"From {result['title']} ({result['url']})"}
+            for result in search_results
+        ]
 
+    async def _asolve_query(self, prompt, file_paths, depth, on_event):
+        """
+        The query pipeline, shared by solve_query and asolve_query
+
+        GPT-4 calls and the web search are awaited; Chroma, context packing and generated
+        code block, so they run in worker threads. Only the top-level query streams its
+        answer, uses the answer cache and gets a UI.
+        """
+        stages = StageRunner(on_event)
+        stream_answer = on_event is not None and depth == 0
+
+        use_answer_cache = self.answer_cache is not None and depth == 0
+        if use_answer_cache:
+            data_version = self.answer_cache.data_version()
+            cached, similarity = await stages.arun("answer_cache", self.answer_cache.lookup, prompt, file_paths, data_version)
+            if cached is not None:
+                cached.update({"cached": True, "similarity": similarity, "timings": stages.report()})
+                return cached
+
+        # Start the web search speculatively; it's only used if the data store can't answer
+        speculative_search = None
+        if self.speculative_search:
+            speculative_search = stages.asubmit("web_search", self.search_api.asearch, prompt, max_results=5)
+
+        # Query the data store
+        results = await stages.arun(
+            "data_query", self.db_manager.query_data, "data_store", prompt, 8, include=["documents", "metadatas"]
+        )
+
+        # Prepare context, ranked and trimmed to the model's token budget
+        data_passages = self._data_passages(results)
+        data_budget = self.context_packer.budget(DATA_SEARCH_PROMPT, prompt, str(file_paths))
+        context, context_report = await stages.arun("pack_context", self.context_packer.pack, data_passages, data_budget)
 
         # Get response from OpenAI
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": DATA_SEARCH_PROMPT},
-                {"role": "user", "content": f"Context: {context}\n\nQuery: {prompt}\n\nFiles: {file_paths}"}
-            ]
-      
+        response = await stages.arun(
+            "data_completion",
+            self._achat,
+            DATA_SEARCH_PROMPT,
+            f"Context: {context}\n\nQuery: {prompt}\n\nFiles: {file_paths}",
+            on_token=self._token_emitter(on_event) if stream_answer else None,
+            expect_json=True
         )
 
-        response_json = json.loads(response.choices[0].message.content)
+        response_json = json.loads(response)
+        if stream_answer and response_json["complete"] != "True":
+            # Streamed text was intermediate context, not the answer
+            on_event({"event": "reset"})
 
         if response_json["complete"] == "True":
             pass
         elif response_json["complete"] == "Tool":
-            tool_result = invoke_native_tool(response_json["result"]["tool_name"], response_json["result"]["tool_args"], self.db_manager)
+            tool_result = await asyncio.to_thread(
+                invoke_native_tool, response_json["result"]["tool_name"], response_json["result"]["tool_args"], self.db_manager
+            )
             response_json["result"] = tool_result
             response_json["complete"] = "True"
         else:
             # Query the internet using search API
             try:
-                search_results = self.search_api.search(prompt, max_results=5)
-                search_context = "\n".join([
-                    f"From {result['title']} ({result['url']}):\n{result['content']}"
-                    for result in search_results
-                ])
-                
-                # Combine with existing context
-                context = f"{context}\n\nWeb Search Results:\n{search_context}"
-                
+                if speculative_search is not None:
+                    search_results = await speculative_search
+                    speculative_search = None
+                else:
+                    search_results = await stages.arun("web_search", self.search_api.asearch, prompt, max_results=5)
+                web_passages = self._web_passages(search_results)
+
+                # Combine with existing context; stored data keeps at most half of the budget
+                budget = self.context_packer.budget(WEB_SEARCH_PROMPT, prompt)
+                data_context, data_report = self.context_packer.pack(data_passages, budget // 2)
+                search_context, web_report = await stages.arun(
+                    "pack_web_context", self.context_packer.pack, web_passages, budget - data_report["used"]
+                )
+                context = f"{data_context}\n\nWeb Search Results:\n{search_context}"
+                context_report = {"data": data_report, "web": web_report}
+
                 # Get new response with search results
-                new_response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": WEB_SEARCH_PROMPT},
-                        {"role": "user", "content": f"Context: {context}\n\nQuery: {prompt}"}
-                    ]
-    
+                new_response = await stages.arun(
+                    "web_completion",
+                    self._achat,
+                    WEB_SEARCH_PROMPT,
+                    f"Context: {context}\n\nQuery: {prompt}",
+                    on_token=self._token_emitter(on_event) if stream_answer else None,
+                    expect_json=True
                 )
-                
-                response_json = json.loads(new_response.choices[0].message.content)
-                
+
+                response_json = json.loads(new_response)
+                if stream_answer and response_json["complete"] != "True":
+                    on_event({"event": "reset"})
+
             except Exception as e:
                 print(f"Search API error: {str(e)}")
                 # Continue with original response if search fails
                 pass
 
+        if speculative_search is not None:
+            stages.cancel("web_search", speculative_search)
+
         if response_json["complete"] == "False":
-            # go to interpret_query
-            response_json = self.interpret_query(prompt, context, file_paths,depth)
+            # Generated code blocks on its sandbox and sub-queries, so it gets a thread
+            response_json = await stages.arun("interpret_query", self.interpret_query, prompt, context, file_paths, depth)
 
         if not response_json["complete"] == "False":
-            if not depth == 0:
-                return response_json
-            else:
-                ui = self.determine_ui(response_json["result"])
-                response_json["UI"] = ui
+            if depth != 0:
                 return response_json
-            
-    
+            ui = await stages.arun("determine_ui", self.adetermine_ui, response_json["result"])
+            response_json["UI"] = ui
+            if use_answer_cache and not response_json.get("error"):
+                stages.submit("answer_cache_store", self.answer_cache.store, prompt, file_paths, dict(response_json), data_version)
+            response_json["timings"] = stages.report()
+            response_json["context_report"] = context_report
+            return response_json
+
+    def _chat(self, system_prompt, user_content, model="gpt-4", on_token=None, expect_json=False):
+        """
+        Run one chat completion through the LLM gateway and return the message content
+
+        Streams it to on_token if given; expect_json retries completions that don't parse.
+        """
+        execution = current_execution()
+        if execution is not None:
+            execution.check()
 
-    def determine_ui(self, result):
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        with span("llm.chat", model=model, streamed=on_token is not None) as call:
+            content, usage = self.gateway.chat(
+                self.client, model, messages,
+                on_token=on_token, on_restart=getattr(on_token, "restart", None), expect_json=expect_json
+            )
+            self._record_usage(call, execution, system_prompt, user_content, content, usage)
+            return content
+
+    async def _achat(self, system_prompt, user_content, model="gpt-4", on_token=None, expect_json=False):
+        """_chat on the AsyncOpenAI client"""
+        execution = current_execution()
+        if execution is not None:
+            execution.check()
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        with span("llm.chat", model=model, streamed=on_token is not None, asynchronous=True) as call:
+            content, usage = await self.gateway.achat(
+                self._async_openai(), model, messages,
+                on_token=on_token, on_restart=getattr(on_token, "restart", None), expect_json=expect_json
+            )
+            self._record_usage(call, execution, system_prompt, user_content, content, usage)
+            return content
+
+    @staticmethod
+    def _record_usage(call, execution, system_prompt, user_content, content, usage=None):
+        if usage:
+            call.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        else:
+            # Streamed responses carry no usage; estimate at ~4 characters per token
+            call.set(prompt_tokens=(len(system_prompt) + len(user_content)) // 4,
+                     completion_tokens=len(content) // 4, estimated_tokens=True)
+        if execution is not None:
+            execution.record_llm_call(call.attributes["prompt_tokens"] + call.attributes["completion_tokens"])
+
+    def _async_openai(self):
+        return self.async_client or self._async_clients.get()
+
+    def _token_emitter(self, on_event):
+        """Build an on_token callback that forwards the decoded "result" text of one completion"""
+        streamer = [ResultFieldStreamer()]
+
+        def on_token(delta):
+            text = streamer[0].feed(delta)
+            if text:
+                on_event({"event": "token", "text": text})
+
+        def restart():
+            # The completion is being retried from scratch; drop what was shown of it
+            streamer[0] = ResultFieldStreamer()
+            on_event({"event": "reset"})
+
+        on_token.restart = restart
+        return on_token
+
+    async def adetermine_ui(self, result):
         #use LLM to determine the UI
         result_string = json.dumps(result)[:500]
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": UI_PROMPT},
-                       {"role": "user", "content": f"Context: {result_string}"}]
-        )
-        return response.choices[0].message.content
+        return await self._achat(UI_PROMPT, f"Context: {result_string}")
 
     
 
-    def interpret_query(self, prompt, context, files=[]):
+    def interpret_query(self, prompt, context, files=[], depth=0):
         """Interpret query and return appropriate response"""
+
+        def subquery_handler(requests):
+            # Sub-queries run under the request's budgets, siblings concurrently. Their depth is
+            # set here, never taken from the generated code
+            execution = current_execution()
+            if execution is None:
+                return [self.solve_query(r["prompt"], r["file_paths"], depth + 1) for r in requests]
+            return execution.run_subqueries(requests, self.solve_query)
+
+        # Reuse a snippet that already solved a task with the same signature
+        if self.code_cache is not None:
+            with span("code_cache.lookup") as lookup:
+                cached = self.code_cache.lookup(prompt, files, depth)
+                lookup.set(cache_hit=cached is not None)
+            if cached is not None:
+                result = self._run_code(cached["bytecode"], subquery_handler, cached=True, globals=cached["globals"])
+                if self._snippet_completed(result):
+                    return result
+                self.code_cache.evict(cached["key"])
         
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": TOOL_SEARCH_PROMPT},
-                {"role": "user", "content": f"Context: {context}Task: {prompt}\n\nInput files: {files}"}
-            ]
-        )
-        code = json.loads(response.choices[0].message.content)
+        response = self._chat(TOOL_SEARCH_PROMPT, f"Context: {context}Task: {prompt}\n\nInput files: {files}\n\nDepth: {depth}",
+                              expect_json=True)
+        code = json.loads(response)
         if not code == "Failed":
-            # Create a namespace dictionary to store variables
-            namespace = {}
-            
-            
-            # Execute the code in the namespace
-            try:
-                exec(code, namespace)
-                # Get the result from the namespace
-                result = namespace.get('result')
-                if result is None:
-                    return {"result": "Error: Code execution did not produce a result", "error": True}
-                
-                return result
-            except Exception as e:
-                error_message = f"Error executing code:\n{traceback.format_exc()}"
-                print(error_message)  # For logging
-                return {"result": error_message, "error": True}
+            # Execute the code in a sandboxed worker process; its sub-queries come back here
+            result = self._run_code(code, subquery_handler)
+            if result is None:
+                return {"result": "Error: Code execution did not produce a result", "error": True}
+            if isinstance(result, dict) and result.get("error"):
+                print(result["result"])  # For logging
+            elif self.code_cache is not None and self._snippet_completed(result):
+                self.code_cache.store(prompt, files, code, depth)
+            return result
         else:
             return {"result": "Failed", "complete": "False"}
 
- 
-
-
+    def _run_code(self, code, subquery_handler, cached=False, globals=None):
+        """Run a snippet in the sandbox under a span; its sub-queries nest below it"""
+        with span("sandbox.run", cached=cached, code_bytes=len(code)) as run:
+            result = self.sandbox.run(code, subquery_handler=subquery_handler, globals=globals)
+            if isinstance(result, dict) and result.get("error"):
+                run.fail(str(result.get("result"))[:500])
+            return result
 
-    
\ No newline at end of file
+    @staticmethod
+    def _snippet_completed(result):
+        return isinstance(result, dict) and result.get("complete") == "True" and not result.get("error")
@@ -0,0 +1,121 @@
+import os
+import argparse
+import mimetypes
+
+from db_manager import get_db_manager
+from extractors import extract_file
+from index_manifest import document_key
+from ingest_queue import IngestQueue, hash_file
+
+
+def _unmanaged_uploads(collection, known_doc_ids, page_size=1000):
+    """Ids of uploaded documents in the collection that the manifest doesn't account for"""
+    unmanaged = set()
+    offset = 0
+    while True:
+        page = collection.get(where={"source": "file_upload"}, include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        unmanaged.update(
+            metadata["id"] for metadata in page["metadatas"] if metadata.get("id") and metadata["id"] not in known_doc_ids
+        )
+        offset += len(page["ids"])
+    return unmanaged
+
+
+def reconcile(db_manager, upload_dir="./uploaded_files", collection_name="data_store", ingest_queue=None,
+              dry_run=False, log=print):
+    """
+    Bring a collection back in line with the files in the upload directory
+
+    Files saved as name_1.ext, name_2.ext, ... are versions of name.ext; each document
+    is indexed from its newest version, embedding only chunks that aren't stored yet.
+    Documents whose files are gone, and uploads stored before the manifest existed
+    that it doesn't account for, are deleted. Run it while no ingestion is in progress.
+
+    Returns counts of what was (or, with dry_run, would be) changed.
+    """
+    manifest = db_manager.manifest
+    names = sorted(
+        name for name in (os.listdir(upload_dir) if os.path.isdir(upload_dir) else [])
+        if os.path.isfile(os.path.join(upload_dir, name))
+    )
+    known_keys = {entry["key"] for entry in manifest.files(collection_name)}
+    existing = set(names) | known_keys
+
+    latest = {}
+    for name in names:
+        path = os.path.join(upload_dir, name)
+        key = document_key(name, existing)
+        if key not in latest or os.path.getmtime(path) > os.path.getmtime(latest[key]):
+            latest[key] = path
+
+    report = {"documents": len(latest), "indexed": 0, "unchanged": 0, "chunks_kept": 0, "chunks_added": 0,
+              "chunks_deleted": 0, "documents_deleted": 0}
+    for key, path in sorted(latest.items()):
+        content_hash = hash_file(path)
+        entry = manifest.get(collection_name, key)
+        if entry and entry["content_hash"] == content_hash:
+            report["unchanged"] += 1
+            continue
+        report["indexed"] += 1
+        log(f"{'Would index' if dry_run else 'Indexing'} {key} from {path}")
+        if dry_run:
+            continue
+
+        file_type = mimetypes.guess_type(path)[0] or ""
+        content, extra_metadata = extract_file(path, file_type)
+        metadata = {
+            "filename": os.path.basename(path),
+            "file_type": file_type,
+            "file_size": os.path.getsize(path),
+            "source": "file_upload",
+            "local_path": path,
+            "document_key": key,
+            **extra_metadata,
+            **db_manager.tables.ingest(path, content_hash)
+        }
+        stats = db_manager.index_document(collection_name, key, content, metadata,
+                                          content_hash=content_hash, local_path=path)
+        report["chunks_kept"] += stats["kept"]
+        report["chunks_added"] += stats["added"]
+        report["chunks_deleted"] += stats["deleted"]
+
+    removed = {entry["doc_id"] for entry in manifest.files(collection_name) if entry["key"] not in latest}
+    collection = db_manager.get_collection(collection_name)
+    removed |= _unmanaged_uploads(collection, manifest.doc_ids(collection_name) - removed)
+    report["documents_deleted"] = len(removed)
+    for doc_id in sorted(removed):
+        log(f"{'Would delete' if dry_run else 'Deleting'} document {doc_id}")
+    if removed and not dry_run:
+        removed = sorted(removed)
+        for start in range(0, len(removed), 100):
+            db_manager.delete_many(collection_name, removed[start:start + 100])
+        if ingest_queue is not None:
+            ingest_queue.forget_documents(removed, collection_name)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile the vector store with the upload directory")
+    parser.add_argument("--upload-dir", default="./uploaded_files")
+    parser.add_argument("--collection", default="data_store")
+    parser.add_argument("--persist-dir", default="./vector_db")
+    parser.add_argument("--ingest-queue", default="./ingest_queue.db",
+                        help="Queue whose jobs for deleted documents are dropped, so the files can be uploaded again")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    report = reconcile(
+        get_db_manager(args.persist_dir),
+        upload_dir=args.upload_dir,
+        collection_name=args.collection,
+        ingest_queue=IngestQueue(args.ingest_queue) if os.path.exists(args.ingest_queue) else None,
+        dry_run=args.dry_run
+    )
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
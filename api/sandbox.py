@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import types
+import queue
+import marshal
+import importlib
+import traceback
+import threading
+import contextvars
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # not available on Windows; CPU limits are skipped there
+    resource = None
+
+
+# Imported once per worker so generated code doesn't pay for them on every run
+PRELOADED_MODULES = ["json", "math", "re", "os", "csv", "datetime", "statistics", "requests", "numpy", "pandas",
+                     "columnar_store"]
+
+
+def _portable(value):
+    """Make a snippet's output safe to send back over the pipe"""
+    return json.loads(json.dumps(value, default=str))
+
+
+class _SubQuerySolver:
+    """Stand-in for QuerySolver inside a worker: sub-queries are sent back to the parent process"""
+
+    _conn = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _send(self, requests):
+        self._conn.send({"type": "solve_query", "requests": requests})
+        reply = self._conn.recv()
+        if reply.get("error"):
+            raise RuntimeError(reply["error"])
+        return reply["results"]
+
+    # depth is accepted because the prompt asks for it, but the parent assigns the real one
+    def solve_query(self, prompt, file_paths=[], depth=0):
+        return self._send([{"prompt": prompt, "file_paths": list(file_paths or []), "depth": depth}])[0]
+
+    def solve_queries(self, prompts, file_paths=[], depth=0):
+        """Solve independent sub-tasks concurrently; returns their outputs in order"""
+        return self._send([{"prompt": prompt, "file_paths": list(file_paths or []), "depth": depth} for prompt in prompts])
+
+
+def _worker_main(conn, cpu_seconds):
+    preloaded = {}
+    for name in PRELOADED_MODULES:
+        try:
+            preloaded[name] = importlib.import_module(name)
+        except ImportError:
+            pass
+
+    # Generated code may "from query_solver import QuerySolver"; give it the proxy
+    _SubQuerySolver._conn = conn
+    proxy_module = types.ModuleType("query_solver")
+    proxy_module.QuerySolver = _SubQuerySolver
+    sys.modules["query_solver"] = proxy_module
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        if resource is not None:
+            # CPU budget for this job on top of what the worker has used so far
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+            resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+        namespace = {"__name__": "__sandbox__", "QuerySolver": _SubQuerySolver, **preloaded, **job.get("globals", {})}
+        try:
+            # Code arrives as source or as marshalled bytecode from the code cache
+            code = marshal.loads(job["code"]) if isinstance(job["code"], bytes) else job["code"]
+            exec(code, namespace)
+            output = namespace.get("output", namespace.get("result"))
+            message = {"type": "result", "ok": True, "result": _portable(output)}
+        except BaseException:
+            message = {"type": "result", "ok": False, "error": traceback.format_exc()}
+        conn.send(message)
+
+
+def _rss_bytes(pid):
+    """Resident set size of a process, or None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Workers held by the snippets enclosing this context; sub-queries run in copies of it
+_held_workers = contextvars.ContextVar("sandbox_held_workers", default=0)
+
+
+class _Worker:
+    def __init__(self, context, cpu_seconds):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, cpu_seconds), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.overflow = False
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+
+
+class SandboxPool:
+    """
+    Pool of pre-warmed subprocesses that run LLM-generated code with resource limits
+
+    Each run is bounded by CPU seconds (RLIMIT_CPU), wall-clock seconds and resident
+    memory; a worker that exceeds a limit or dies is killed and replaced. Calls to
+    QuerySolver().solve_query/solve_queries inside the code are forwarded to
+    subquery_handler in the parent as a list of {prompt, file_paths, depth} requests,
+    so no OpenAI/Chroma clients are created in the workers.
+    """
+
+    def __init__(self, size=2, cpu_seconds=30, wall_seconds=120, max_rss_bytes=1024 * 1024 * 1024, max_jobs_per_worker=50,
+                 acquire_timeout=1.0, max_overflow=None):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.max_overflow = size if max_overflow is None else max_overflow
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.max_rss_bytes = max_rss_bytes
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._overflow = 0
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._context, self.cpu_seconds)
+
+    def _acquire(self):
+        """
+        Take an idle worker, or None if a nested snippet can't get one
+
+        Top-level callers block on the pool. A snippet waiting on a sub-query holds its
+        worker, so nested snippets waiting for the pool could deadlock; after
+        acquire_timeout they get a temporary extra worker instead, up to max_overflow.
+        """
+        if _held_workers.get() == 0:
+            return self._idle.get()
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            pass
+        with self._lock:
+            spawn = self._overflow < self.max_overflow
+            if spawn:
+                self._overflow += 1
+        if not spawn:
+            try:
+                return self._idle.get(timeout=self.wall_seconds)
+            except queue.Empty:
+                return None
+        try:
+            worker = self._spawn()
+        except BaseException:
+            with self._lock:
+                self._overflow -= 1
+            raise
+        worker.overflow = True
+        return worker
+
+    def _release(self, worker, healthy):
+        # Recycle workers that have run many jobs or kept a lot of memory from the last one,
+        # and drop extra workers as soon as they are done
+        if worker.overflow:
+            with self._lock:
+                self._overflow -= 1
+            if healthy:
+                worker.close()
+            else:
+                worker.kill()
+            return
+        rss = _rss_bytes(worker.process.pid)
+        bloated = rss is not None and rss > self.max_rss_bytes // 2
+        if healthy and not bloated and worker.jobs < self.max_jobs_per_worker:
+            self._idle.put(worker)
+            return
+        if healthy:
+            worker.close()
+        else:
+            worker.kill()
+        self._idle.put(self._spawn())
+
+    def run(self, code, subquery_handler=None, globals=None):
+        """
+        Execute code in a worker and return its "output" (or "result") variable
+
+        code is source text or marshalled bytecode; globals are extra names made
+        available to it, such as the arguments of a cached snippet.
+
+        Returns {"result": ..., "error": True} if the code raised or broke a limit.
+        """
+        worker = self._acquire()
+        if worker is None:
+            return {"result": "Error: no sandbox worker became available for a nested snippet", "error": True}
+        worker.jobs += 1
+        healthy = False
+        held = _held_workers.set(_held_workers.get() + 1)
+        try:
+            worker.conn.send({"code": code, "globals": globals or {}})
+            deadline = time.monotonic() + self.wall_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {"result": f"Error: code execution exceeded {self.wall_seconds}s wall-clock limit", "error": True}
+                rss = _rss_bytes(worker.process.pid)
+                if rss is not None and rss > self.max_rss_bytes:
+                    return {"result": f"Error: code execution exceeded {self.max_rss_bytes} bytes of memory", "error": True}
+                if not worker.conn.poll(min(remaining, 0.1)):
+                    continue
+
+                message = worker.conn.recv()
+                if message["type"] == "solve_query":
+                    # Time spent on sub-queries doesn't count against the snippet's own limit
+                    started = time.monotonic()
+                    reply = {"results": None}
+                    try:
+                        if subquery_handler is None:
+                            raise RuntimeError("Sub-queries are not available here")
+                        reply["results"] = _portable(subquery_handler(message["requests"]))
+                    except Exception as e:
+                        reply["error"] = str(e)
+                    worker.conn.send(reply)
+                    deadline += time.monotonic() - started
+                    continue
+
+                healthy = True
+                if message["ok"]:
+                    return message["result"]
+                return {"result": f"Error executing code:\n{message['error']}", "error": True}
+        except (EOFError, OSError, BrokenPipeError):
+            # The worker died, typically from SIGXCPU after using up its CPU budget
+            return {"result": f"Error: code execution was terminated (CPU limit {self.cpu_seconds}s or crash)", "error": True}
+        finally:
+            _held_workers.reset(held)
+            self._release(worker, healthy)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
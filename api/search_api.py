@@ -1,89 +1,357 @@
+import httpx
 import requests
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Optional
 import os
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 import html2text
 
+from page_cache import PageCache
+from tracing import span, in_context
+from pipeline import LoopLocal
+from single_flight import SingleFlight
+
 class SearchAPI:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_workers: int = 10, per_host_limit: int = 2, fetch_deadline: float = 12.0,
+                 page_cache: PageCache = None, search_cache: PageCache = None):
         self.api_key = api_key
         self.search_engine_id = os.getenv("GOOGLE_SEARCH_ENGINE_ID")
-        self.base_url = "https://www.googleapis.com/customsearch/v1"
-        self.html_converter = html2text.HTML2Text()
-        self.html_converter.ignore_links = True
+        self.base_url = os.getenv("GOOGLE_SEARCH_URL", "https://www.googleapis.com/customsearch/v1")
+
+        # Pooled keep-alive session shared by all fetches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Fetch engine: bounded worker pool, per-host concurrency limit and overall deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="page-fetch")
+        self.per_host_limit = per_host_limit
+        self.fetch_deadline = fetch_deadline
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host_limit))
+        self._host_lock = threading.Lock()
+        # Concurrent fetches of one URL, from any request, share a single download
+        self.page_flight = SingleFlight("pages")
+        # httpx client and per-host semaphores of the async fetch path, one set per event loop
+        self._async_state = LoopLocal(lambda: {
+            "client": httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+                follow_redirects=True
+            ),
+            "hosts": defaultdict(lambda: asyncio.Semaphore(per_host_limit))
+        })
+
+        # Cleaned page text keyed by URL, and raw Custom Search responses keyed by query
+        cache_dir = os.getenv("SEARCH_CACHE_DIR", "./cache")
+        self.page_cache = page_cache or PageCache(
+            path=os.path.join(cache_dir, "pages.db"),
+            ttl=int(os.getenv("PAGE_CACHE_TTL", 86400)),
+            max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+        )
+        self.search_cache = search_cache or PageCache(
+            path=os.path.join(cache_dir, "search.db"),
+            ttl=int(os.getenv("SEARCH_CACHE_TTL", 21600)),
+            max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", 20 * 1024 * 1024))
+        )
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        with self._host_lock:
+            return self._host_slots[urlparse(url).netloc]
+
+    @staticmethod
+    def _revalidation_headers(cached: Dict) -> Dict:
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def _html_to_text(self, html: str) -> str:
+        # Parse HTML
+        soup = BeautifulSoup(html, 'html.parser')
 
-    def get_page_content(self, url: str) -> str:
+        # Remove script and style elements
+        for script in soup(["script", "style"]):
+            script.decompose()
+
+        # Convert HTML to markdown/text; HTML2Text is a stateful parser, so each page gets its own
+        converter = html2text.HTML2Text()
+        converter.ignore_links = True
+        text = converter.handle(str(soup))
+
+        # Clean up the text
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        clean_text = ' '.join(lines)
+
+        # Truncate if too long
+        return clean_text[:10000] if len(clean_text) > 10000 else clean_text
+
+    def get_page_content(self, url: str, timeout: float = 10, cancel_event: threading.Event = None) -> str:
         """
         Fetch and extract text content from a webpage
+
+        Cached text is served while fresh; stale entries are revalidated with
+        If-None-Match/If-Modified-Since so unchanged pages are not re-parsed.
+        A URL already being fetched is not requested again. Once cancel_event is
+        set, a fetch still waiting for its host's connection slot gives up with "".
+        """
+        while True:
+            text = self.page_flight.do(url, self._get_page_content, url, timeout, cancel_event)[0]
+            if text is not None:
+                return text
+            if cancel_event is not None and cancel_event.is_set():
+                return ""
+            # The fetch this call joined was cancelled by its own caller
+
+    def _get_page_content(self, url: str, timeout: float, cancel_event: threading.Event = None) -> Optional[str]:
+        with span("search.fetch_page", host=urlparse(url).netloc) as fetch:
+            try:
+                cached = self.page_cache.lookup(url)
+                if cached is not None and cached["fresh"]:
+                    fetch.set(cache_hit=True, cache="fresh")
+                    return cached["value"]
+
+                headers = self._revalidation_headers(cached)
+                slot = self._host_slot(url)
+                while not slot.acquire(timeout=0.05 if cancel_event is not None else None):
+                    if cancel_event.is_set():
+                        fetch.set(cancelled=True)
+                        return None
+                try:
+                    response = self.session.get(url, timeout=timeout, headers=headers)
+                finally:
+                    slot.release()
+                fetch.set(status_code=response.status_code, bytes=len(response.content))
+                if response.status_code == 304 and cached is not None:
+                    self.page_cache.touch(url)
+                    fetch.set(cache_hit=True, cache="revalidated")
+                    return cached["value"]
+                response.raise_for_status()
+
+                text = self._html_to_text(response.text)
+                self.page_cache.set(
+                    url,
+                    text,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified")
+                )
+                fetch.set(cache_hit=False, cache="stale" if cached is not None else "miss", text_chars=len(text))
+                return text
+
+            except Exception as e:
+                print(f"Error fetching {url}: {str(e)}")
+                fetch.fail(e)
+                return ""
+
+    async def aget_page_content(self, url: str, timeout: float = 10) -> str:
+        """get_page_content on the event loop's httpx client; HTML is converted in a worker thread"""
+        return (await self.page_flight.ado(url, self._aget_page_content, url, timeout))[0]
+
+    async def _aget_page_content(self, url: str, timeout: float) -> str:
+        with span("search.fetch_page", host=urlparse(url).netloc, asynchronous=True) as fetch:
+            try:
+                cached = self.page_cache.lookup(url)
+                if cached is not None and cached["fresh"]:
+                    fetch.set(cache_hit=True, cache="fresh")
+                    return cached["value"]
+
+                state = self._async_state.get()
+                headers = self._revalidation_headers(cached)
+                async with state["hosts"][urlparse(url).netloc]:
+                    response = await state["client"].get(url, timeout=timeout, headers=headers)
+                fetch.set(status_code=response.status_code, bytes=len(response.content))
+                if response.status_code == 304 and cached is not None:
+                    self.page_cache.touch(url)
+                    fetch.set(cache_hit=True, cache="revalidated")
+                    return cached["value"]
+                response.raise_for_status()
+
+                text = await asyncio.to_thread(self._html_to_text, response.text)
+                self.page_cache.set(
+                    url,
+                    text,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified")
+                )
+                fetch.set(cache_hit=False, cache="stale" if cached is not None else "miss", text_chars=len(text))
+                return text
+
+            except Exception as e:
+                print(f"Error fetching {url}: {str(e)}")
+                fetch.fail(e)
+                return ""
+
+    def fetch_pages(self, urls: List[str], deadline: float = None, cancel_event: threading.Event = None) -> Dict[str, str]:
+        """
+        Fetch several pages in parallel
+
+        Returns a mapping of url to page text for the pages that finished before the deadline;
+        pages still in flight when it expires are left out and keep running in the background.
+        Once cancel_event is set, fetches that haven't started are dropped and {} is returned.
         """
+        deadline = self.fetch_deadline if deadline is None else deadline
+        started = time.monotonic()
+
+        def fetch(url):
+            if cancel_event is not None and cancel_event.is_set():
+                return ""
+            return self.get_page_content(url, min(10, deadline), cancel_event)
+
+        futures = {self.executor.submit(in_context(fetch), url): url for url in dict.fromkeys(urls)}
+        not_done = set(futures)
+        while not_done:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            # Wake up regularly to notice cancellation while pages are downloading
+            _, not_done = wait(not_done, timeout=min(remaining, 0.05) if cancel_event is not None else remaining)
+            if cancel_event is not None and cancel_event.is_set():
+                for future in not_done:
+                    future.cancel()
+                return {}
+        for future in not_done:
+            future.cancel()
+            print(f"Fetch deadline exceeded for {futures[future]}")
+        return {url: future.result() for future, url in futures.items() if future not in not_done}
+
+    async def afetch_pages(self, urls: List[str], deadline: float = None) -> Dict[str, str]:
+        """
+        fetch_pages on the event loop; pages still in flight at the deadline are left out and finish in the background
+
+        If the calling task is cancelled, its page fetches are cancelled with it, unless
+        another request is waiting on the same page.
+        """
+        deadline = self.fetch_deadline if deadline is None else deadline
+        tasks = {
+            asyncio.ensure_future(self.aget_page_content(url, min(10, deadline))): url
+            for url in dict.fromkeys(urls)
+        }
+        if not tasks:
+            return {}
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            # Parse HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Convert HTML to markdown/text
-            text = self.html_converter.handle(str(soup))
-            
-            # Clean up the text
-            lines = [line.strip() for line in text.splitlines() if line.strip()]
-            clean_text = ' '.join(lines)
-            
-            # Truncate if too long
-            return clean_text[:10000] if len(clean_text) > 10000 else clean_text
-            
-        except Exception as e:
-            print(f"Error fetching {url}: {str(e)}")
-            return ""
-
-    def search(self, query: str, max_results: int = 5) -> List[Dict]:
+            done, not_done = await asyncio.wait(tasks, timeout=deadline)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        for task in not_done:
+            print(f"Fetch deadline exceeded for {tasks[task]}")
+        return {tasks[task]: task.result() for task in done}
+
+    def search(self, query: str, max_results: int = 5, cancel_event: threading.Event = None) -> List[Dict]:
         """
         Search using Google Custom Search API and fetch full content
-        
+
         Args:
             query: Search query string
             max_results: Maximum number of results to return (max 10 for free tier)
-            
+            cancel_event: When set, the search stops early: before the API call, and while
+                pages are being fetched (pages not yet started are skipped)
+
         Returns:
-            List of search results with full content
+            List of search results with full content; results whose page could not be
+            fetched in time fall back to the snippet and are marked "snippet_only"
         """
-        try:
-            response = requests.get(
-                self.base_url,
-                params={
-                    "q": query,
-                    "key": self.api_key,
-                    "cx": self.search_engine_id,
-                    "num": min(max_results, 10)
-                }
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            results = []
-            
-            for item in data.get("items", []):
-                title = item.get("title", "")
-                url = item.get("link", "")
-                snippet = item.get("snippet", "")
-                
-                # Fetch full content
-                content = self.get_page_content(url)
-                
-                results.append({
-                    "title": title,
-                    "url": url,
-                    "snippet": snippet,
-                    "content": content
-                })
-            
-            return results
-            
-        except Exception as e:
-            print(f"Google Search API error: {str(e)}")
-            return [] 
\ No newline at end of file
+        with span("search.query", max_results=max_results) as search:
+            try:
+                if cancel_event is not None and cancel_event.is_set():
+                    search.set(cancelled=True)
+                    return []
+                num = min(max_results, 10)
+                cache_key = f"{self.search_engine_id}:{num}:{query}"
+                data = self.search_cache.get_json(cache_key)
+                search.set(cache_hit=data is not None)
+                if data is None:
+                    response = self.session.get(self.base_url, params=self._search_params(query, num), timeout=10)
+                    response.raise_for_status()
+                    search.set(bytes=len(response.content))
+
+                    data = response.json()
+                    self.search_cache.set_json(cache_key, data)
+
+                items = data.get("items", [])
+                if cancel_event is not None and cancel_event.is_set():
+                    search.set(cancelled=True)
+                    return []
+
+                # Fetch full content of all result pages in parallel
+                pages = self.fetch_pages([item.get("link", "") for item in items if item.get("link")],
+                                         cancel_event=cancel_event)
+                if cancel_event is not None and cancel_event.is_set():
+                    search.set(cancelled=True)
+                    return []
+
+                results = self._results(items, pages)
+                search.set(results=len(results), snippet_only=sum(result["snippet_only"] for result in results))
+                return results
+
+            except Exception as e:
+                print(f"Google Search API error: {str(e)}")
+                search.fail(e)
+                return []
+
+    async def asearch(self, query: str, max_results: int = 5) -> List[Dict]:
+        """search with the Custom Search request and page fetches awaited on the event loop"""
+        with span("search.query", max_results=max_results, asynchronous=True) as search:
+            try:
+                num = min(max_results, 10)
+                cache_key = f"{self.search_engine_id}:{num}:{query}"
+                data = self.search_cache.get_json(cache_key)
+                search.set(cache_hit=data is not None)
+                if data is None:
+                    response = await self._async_state.get()["client"].get(
+                        self.base_url, params=self._search_params(query, num), timeout=10
+                    )
+                    response.raise_for_status()
+                    search.set(bytes=len(response.content))
+
+                    data = response.json()
+                    self.search_cache.set_json(cache_key, data)
+
+                items = data.get("items", [])
+                pages = await self.afetch_pages([item.get("link", "") for item in items if item.get("link")])
+
+                results = self._results(items, pages)
+                search.set(results=len(results), snippet_only=sum(result["snippet_only"] for result in results))
+                return results
+
+            except Exception as e:
+                print(f"Google Search API error: {str(e)}")
+                search.fail(e)
+                return []
+
+    def _search_params(self, query: str, num: int) -> Dict:
+        return {"q": query, "key": self.api_key, "cx": self.search_engine_id, "num": num}
+
+    @staticmethod
+    def _results(items: List[Dict], pages: Dict[str, str]) -> List[Dict]:
+        results = []
+        for item in items:
+            title = item.get("title", "")
+            url = item.get("link", "")
+            snippet = item.get("snippet", "")
+            content = pages.get(url, "")
+
+            results.append({
+                "title": title,
+                "url": url,
+                "snippet": snippet,
+                "content": content or snippet,
+                "snippet_only": not content
+            })
+        return results
+
+    def cache_stats(self) -> Dict:
+        return {
+            "pages": self.page_cache.stats(),
+            "search": self.search_cache.stats(),
+            "coalesced_fetches": self.page_flight.stats()
+        }
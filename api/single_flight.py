@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from tracing import span
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation
+
+    The first caller for a key runs it; callers arriving while it is in flight wait for
+    its result (or exception) instead of computing their own. Nothing is cached once
+    the computation finishes. Sync and async callers share the same in-flight calls,
+    so a request on the event loop can attach to one running in a worker thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._inflight = {}
+        self._waiting = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.followers += 1
+                self._waiting[future] += 1
+                return future, False
+            # Running futures can't be cancelled, so a follower giving up doesn't cancel the call for everyone
+            future = self._inflight[key] = Future()
+            future.set_running_or_notify_cancel()
+            self._waiting[future] = 1
+            self.leaders += 1
+            return future, True
+
+    def _leave(self, key, future):
+        """Stop waiting on a call; returns True if no caller is left waiting for it"""
+        with self._lock:
+            if future not in self._waiting:
+                return False
+            self._waiting[future] -= 1
+            if self._waiting[future] > 0:
+                return False
+            # Callers arriving from now on start a fresh call rather than join the abandoned one
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            return True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            self._waiting.pop(future, None)
+            self._tasks.pop(future, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return (result, shared): fn's result, and whether it came from another caller's call"""
+        future, leader = self._join(key)
+        if not leader:
+            with span(f"coalesced.{self.name}"):
+                try:
+                    return future.result(), True
+                finally:
+                    self._leave(key, future)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result, False
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """
+        do() for a coroutine function
+
+        The leader's computation runs as its own task, so it still completes for the
+        followers if the leader's request is cancelled. Once every caller waiting on it
+        has been cancelled, the task is cancelled too.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            with span(f"coalesced.{self.name}"):
+                return await self._await(key, future), True
+
+        def settle(task):
+            if task.cancelled():
+                self._settle(key, future, error=asyncio.CancelledError())
+            else:
+                self._settle(key, future, task.result() if task.exception() is None else None, task.exception())
+
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        with self._lock:
+            self._tasks[future] = (asyncio.get_running_loop(), task)
+        task.add_done_callback(settle)
+        return await self._await(key, future), False
+
+    async def _await(self, key, future):
+        """Wait for a call's result, cancelling the call if this was its last waiting caller"""
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if self._leave(key, future):
+                with self._lock:
+                    loop, task = self._tasks.get(future, (None, None))
+                if task is not None:
+                    # The task may belong to another thread's event loop
+                    loop.call_soon_threadsafe(task.cancel)
+            raise
+        self._leave(key, future)
+        return result
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                "calls": calls,
+                "coalesced": self.followers,
+                "in_flight": len(self._inflight),
+                "hit_rate": self.followers / calls if calls else 0.0
+            }
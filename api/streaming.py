@@ -0,0 +1,64 @@
+import json
+import re
+
+
+_RESULT_KEY = re.compile(r'"result"\s*:\s*')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class ResultFieldStreamer:
+    """
+    Incrementally decodes the "result" string of a JSON completion as its tokens arrive
+
+    feed() takes raw completion deltas and returns the newly decoded text of the
+    result value, so the answer can be shown before the JSON object is complete.
+    Non-string results produce no text.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None  # index of the next undecoded character of the result value
+        self.done = False
+
+    def feed(self, delta):
+        self.buffer += delta
+        if self.done:
+            return ""
+        if self.position is None:
+            match = _RESULT_KEY.search(self.buffer)
+            if match is None or match.end() >= len(self.buffer):
+                return ""
+            if self.buffer[match.end()] != '"':
+                self.done = True
+                return ""
+            self.position = match.end() + 1
+
+        decoded = []
+        buffer = self.buffer
+        while self.position < len(buffer):
+            char = buffer[self.position]
+            if char == '"':
+                self.done = True
+                break
+            if char != '\\':
+                decoded.append(char)
+                self.position += 1
+                continue
+            # Wait for the rest of an escape sequence before decoding it
+            if self.position + 1 >= len(buffer):
+                break
+            code = buffer[self.position + 1]
+            if code == 'u':
+                if self.position + 6 > len(buffer):
+                    break
+                decoded.append(chr(int(buffer[self.position + 2:self.position + 6], 16)))
+                self.position += 6
+            else:
+                decoded.append(_ESCAPES.get(code, code))
+                self.position += 2
+        return "".join(decoded)
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -89,7 +89,7 @@ The output (as a json object indicated above) should be stored as a variable nam
 To write the code, you can use any of your prior knowledge, and the context provided. You can call any python library, function or api. 
 Please pay attention:
 1. Write the code in a top-down manner, by decomposing the task into smaller sub-tasks. 
-2. If there's a sub-task which you can not figure out how to do, create a QuerySolver object and call its solve_query method. The input arguments are prompt for the sub-task, file_paths, depth (depth is the depth of the sub-task, add 1 to the depth of the argument "depth" of current method).
+2. If there's a sub-task which you can not figure out how to do, create a QuerySolver object and call its solve_query method. The input arguments are prompt for the sub-task, file_paths, depth (depth is the depth of the sub-task, add 1 to the depth of the argument "depth" of current method). If there are several independent sub-tasks, call its solve_queries method once instead, with the list of sub-task prompts, file_paths and depth; they are solved concurrently and a list of outputs is returned in the same order. The depth of the current task is given as "Depth" below the input files.
 3. The output of the solve_query method is as follows:
 {
     "result": "The final answer to the user's question or task, which can be a text, a json object, etc, depends on the sub-task. You must include the expected format in your prompt input into the solve_query method",
@@ -97,6 +97,7 @@ Please pay attention:
 }
 4. If you need to run command line commands, call the commands in python code. Remember the effect of each command and where to read the output.
 5. Import any package before using it, and install any package before importing it. You can check and modify the ./requirements.txt file, add any package you need and install it.
+6. If the context comes from a table (it shows a table_id and its columns), compute aggregations with columnar_store.aggregate(table_id, agg, column, group_by, where) instead of reading the file. agg is "count", "sum", "mean", "min" or "max"; group_by is a column name, or "column:year" / "column:month" for dates; where is like {"field": "F-12", "date": {"$gte": "2023-01-01", "$lt": "2024-01-01"}}. It returns a number, or a dict from group value to number.
 
 If you can write the code, return the definition of the method and the code to call the method.
 
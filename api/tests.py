@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from page_cache import PageCache
+from search_api import SearchAPI
+
+
+class _SlowPages(BaseHTTPRequestHandler):
+    """Custom Search stand-in answering at once, with pages that take a while to download"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        base_url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        if self.path.startswith("/customsearch/v1"):
+            items = [{"title": f"Page {page}", "link": f"{base_url}/pages/{page}.html", "snippet": ""} for page in range(5)]
+            self._send(json.dumps({"items": items}), "application/json")
+            return
+        time.sleep(self.server.page_latency)
+        self._send(f"<html><body><p>{self.path}</p></body></html>", "text/html")
+
+
+class AsyncSearchCancellationTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowPages)
+        self.server.page_latency = 0.5
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        os.environ["GOOGLE_SEARCH_URL"] = f"http://127.0.0.1:{self.server.server_address[1]}/customsearch/v1"
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.search_api = SearchAPI(
+            api_key="test",
+            page_cache=PageCache(path=os.path.join(self.cache_dir.name, "pages.db")),
+            search_cache=PageCache(path=os.path.join(self.cache_dir.name, "search.db"))
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache_dir.cleanup()
+
+    async def test_cancelled_search_stops_page_fetches(self):
+        search = asyncio.ensure_future(self.search_api.asearch("soil moisture"))
+        # Let the Custom Search request return and the page downloads start
+        while self.search_api.page_flight.stats()["in_flight"] < 5:
+            await asyncio.sleep(0.01)
+        search.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await search
+
+        await asyncio.sleep(self.server.page_latency * 2)
+        self.assertEqual(self.search_api.page_flight.stats()["in_flight"], 0)
+        self.assertEqual(asyncio.all_tasks() - {asyncio.current_task()}, set())
+        port = self.server.server_address[1]
+        for page in range(5):
+            self.assertIsNone(self.search_api.page_cache.lookup(f"http://127.0.0.1:{port}/pages/{page}.html"))
+
+
+if __name__ == "__main__":
+    unittest.main()
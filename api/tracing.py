@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+# Upper bounds in seconds, from a cache lookup to a recursive sub-query
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Span:
+    """One timed operation of a request; children are the spans opened while it was current"""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.status = "ok"
+        self.started_at = time.time()
+        self.seconds = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, **counts):
+        """Increment numeric attributes such as tokens or bytes"""
+        with self._lock:
+            for name, value in counts.items():
+                self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def fail(self, error):
+        """Mark the span as failed for an error that was handled instead of raised"""
+        with self._lock:
+            self.status = "error"
+            self.attributes["error"] = str(error)
+
+    def _add_child(self, span):
+        with self._lock:
+            self.children.append(span)
+
+    def finish(self, status="ok"):
+        self.seconds = time.perf_counter() - self._started
+        if status != "ok":
+            self.status = status
+
+    def to_dict(self):
+        with self._lock:
+            children = list(self.children)
+            attributes = dict(self.attributes)
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": round(self.seconds, 6) if self.seconds is not None else None,
+            "status": self.status,
+            "attributes": attributes,
+            "children": [child.to_dict() for child in children]
+        }
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((labels or {}).items()))
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, self._key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self, gauges=None):
+        """
+        Metrics as Prometheus exposition text
+
+        gauges is an optional {name: [(labels, value), ...]} of point-in-time values
+        gathered by the caller, such as cache sizes.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = {key: {"buckets": list(value["buckets"]), "count": value["count"], "sum": value["sum"]}
+                          for key, value in self._histograms.items()}
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        for name, samples in sorted((gauges or {}).items()):
+            header(name, "gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{self._labels(self._key(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("query_solver_span_seconds", "Duration of traced operations")
+metrics.describe("query_solver_span_errors_total", "Traced operations that failed")
+metrics.describe("query_solver_tokens_total", "LLM tokens used, by operation")
+metrics.describe("query_solver_bytes_total", "Bytes received over the network, by operation")
+metrics.describe("query_solver_cache_lookups_total", "Cache lookups by operation and result")
+
+
+def current_span():
+    """The innermost open span in this context, if any"""
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    """Set attributes such as cache_hit on the current span; a no-op outside of a span"""
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def _record(span):
+    metrics.observe("query_solver_span_seconds", span.seconds, span=span.name)
+    if span.status == "error":
+        metrics.inc("query_solver_span_errors_total", span=span.name)
+    attributes = span.attributes
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if attributes.get(kind):
+            metrics.inc("query_solver_tokens_total", attributes[kind], span=span.name, kind=kind.split("_")[0])
+    if attributes.get("bytes"):
+        metrics.inc("query_solver_bytes_total", attributes["bytes"], span=span.name)
+    if "cache_hit" in attributes:
+        metrics.inc("query_solver_cache_lookups_total", span=span.name,
+                    result="hit" if attributes["cache_hit"] else "miss")
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block as a child of the current span and record it in the metrics
+
+    Yields the Span so the block can add token or byte counts and cache flags.
+    Contexts copied into worker threads (contextvars.copy_context) keep the nesting.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    if parent is not None:
+        parent._add_child(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except asyncio.CancelledError:
+        current.finish("cancelled")
+        raise
+    except BaseException:
+        current.finish("error")
+        raise
+    else:
+        current.finish()
+    finally:
+        _current_span.reset(token)
+        _record(current)
+
+
+def in_context(fn):
+    """Wrap fn to run in a copy of the calling context, e.g. before handing it to an executor"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def dump_trace(root, directory=None):
+    """Write a finished root span as <trace_id>.json under directory (default QUERY_TRACE_DIR); returns the path"""
+    directory = directory or os.getenv("QUERY_TRACE_DIR")
+    if not directory:
+        return None
+    path = os.path.join(directory, f"{root.trace_id}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"trace_id": root.trace_id, **root.to_dict()}, f, indent=2, default=str)
+    except OSError as e:
+        print(f"Trace dump error: {str(e)}")
+        return None
+    return path
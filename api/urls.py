@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import QuerySolverView
+from .views import QuerySolverView, HealthView
 
 urlpatterns = [
     path('query_solving/', QuerySolverView.as_view(), name='query_solving'),
+    path('health/', HealthView.as_view(), name='health'),
 ] 
@@ -1,37 +1,163 @@
+
 import sys
 import os
+import json
+import asyncio
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .query_solver import QuerySolver
-from .db_manager import DBManager
+from .query_solver import get_query_solver, solver_state
+from .streaming import sse_event
+# Same module the solver records into (api/ is on the import path for its flat imports)
+from tracing import span, dump_trace, metrics
+from llm_gateway import get_llm_gateway
+
+
+async def solve_traced(prompt, file_paths, include_trace=False, on_event=None):
+    """
+    Solve a request under a root span
+
+    The finished trace is written to QUERY_TRACE_DIR when that is set, and returned
+    under "trace" in the result when include_trace is true.
+    """
+    try:
+        with span("query_solving", stream=on_event is not None) as root:
+            # Building the solver blocks, but only the first request does it
+            solver = await asyncio.to_thread(get_query_solver)
+            result = await solver.asolve_query(prompt, file_paths=file_paths, on_event=on_event)
+    finally:
+        dump_trace(root)
+    if include_trace and isinstance(result, dict):
+        result["trace"] = {"trace_id": root.trace_id, **root.to_dict()}
+    return result
+
+
+def cache_stats(solver):
+    caches = solver.search_api.cache_stats()
+    caches["embeddings"] = solver.db_manager.embedding_function.stats()
+    if solver.code_cache is not None:
+        caches["code"] = solver.code_cache.stats()
+    if solver.answer_cache is not None:
+        caches["answers"] = solver.answer_cache.stats()
+    if solver.query_flight is not None:
+        caches["coalesced_queries"] = solver.query_flight.stats()
+    return caches
 
 
-class QuerySolverView(APIView):
-    def __init__(self):
-        super().__init__()
-        self.query_solver = QuerySolver()
+class QuerySolverView(View):
+    """
+    query_solving as an async view
 
-    def post(self, request):
+    Under ASGI a query waiting on GPT-4 or web fetches holds no worker thread, so one
+    process can serve many concurrent queries. Accepts JSON or multipart form bodies.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True  # an API endpoint without session auth, as under DRF
+        return view
+
+    @staticmethod
+    def _request_data(request):
+        if request.content_type == "multipart/form-data":
+            data = request.POST.dict()
+            data["file_paths"] = request.POST.getlist("file_paths")
+            return data
+        data = json.loads(request.body or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("JSON body must be an object")
+        return data
+
+    async def post(self, request):
         try:
-            prompt = request.data.get('prompt')
-            file_paths = request.data.get('file_paths', [])
+            try:
+                data = self._request_data(request)
+            except ValueError as e:
+                return JsonResponse({"error": f"Malformed request: {str(e)}"}, status=400)
+            prompt = data.get('prompt')
+            file_paths = data.get('file_paths', [])
+            include_trace = bool(data.get('trace')) or request.GET.get('trace') in ('1', 'true')
             
             if not prompt:
-                return Response(
-                    {"error": "Prompt is required"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+                return JsonResponse({"error": "Prompt is required"}, status=400)
             
-            result = QuerySolver().solve_query(prompt, file_paths=file_paths)
+            if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+                return self.stream(prompt, file_paths, include_trace)
+
+            result = await solve_traced(prompt, file_paths, include_trace)
             # result is a json object
-            
-            
-            return Response(result, status=status.HTTP_200_OK)
+            return JsonResponse(result, safe=False, status=200)
             
         except Exception as e:
-            return Response(
-                {"error": str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return JsonResponse({"error": str(e)}, status=500)
+
+    def stream(self, prompt, file_paths, include_trace=False):
+        """
+        Answer as server-sent events: "stage" progress, answer "token"s, "reset" when the
+        streamed text turned out not to be the answer, then one "result" or "error"
+        """
+
+        async def event_stream():
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+
+            def on_event(event):
+                # Stages that run in worker threads report from there
+                loop.call_soon_threadsafe(events.put_nowait, event)
+
+            async def solve():
+                try:
+                    result = await solve_traced(prompt, file_paths, include_trace, on_event=on_event)
+                    events.put_nowait({"event": "result", "result": result})
+                except Exception as e:
+                    events.put_nowait({"event": "error", "error": str(e)})
+
+            task = asyncio.ensure_future(solve())
+            try:
+                while True:
+                    event = await events.get()
+                    name = event.pop("event")
+                    yield sse_event(name, event)
+                    if name in ("result", "error"):
+                        break
+            finally:
+                # The client went away before the answer was complete
+                if not task.done():
+                    task.cancel()
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class HealthView(APIView):
+    def get(self, request):
+        """Report whether the shared QuerySolver has finished warming up"""
+        state = solver_state()
+        if state["status"] == "ready":
+            solver = get_query_solver()
+            state["caches"] = cache_stats(solver)
+            state["db_latency"] = solver.db_manager.latency_stats()
+            state["llm_gateway"] = solver.gateway.stats()
+        code = status.HTTP_200_OK if state["status"] == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(state, status=code)
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        """Span latencies, token, byte, cache and LLM gateway counters and gauges in the Prometheus text format"""
+        ready = solver_state()["status"] == "ready"
+        gauges = {"query_solver_ready": [({}, int(ready))], **get_llm_gateway().gauges()}
+        if ready:
+            for cache, stats in cache_stats(get_query_solver()).items():
+                gauges.setdefault("query_solver_cache_hit_ratio", []).append(({"cache": cache}, stats["hit_rate"]))
+                if "entries" in stats or "stored" in stats:
+                    gauges.setdefault("query_solver_cache_entries", []).append(
+                        ({"cache": cache}, stats.get("entries", stats.get("stored")))
+                    )
+        return HttpResponse(metrics.render(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -7,17 +7,38 @@ import json
 from datetime import datetime
 import uuid
 
-from db_manager import DBManager
+from db_manager import get_db_manager
+from ingest_queue import IngestQueue, IngestWorker
 import requests
+import shutil
+import hashlib
+import time
 
-import PyPDF2
-from io import BytesIO
+
+db_manager = get_db_manager()
+
+
+@st.cache_resource
+def get_ingest_queue():
+    """One ingestion queue and background worker per Streamlit process"""
+    queue = IngestQueue()
+    IngestWorker(queue, db_manager).start()
+    return queue
+
+
+ingest_queue = get_ingest_queue()
 
 
-db_manager = DBManager()
 def process_file(file):
-        """Process uploaded file and store in vector database and local directory"""
+        """Save an uploaded file and queue it for indexing; returns the ingestion job"""
         try:
+            # Skip files whose bytes are already queued or indexed, under this name or another;
+            # a new name for them is recorded as an alias of the existing document
+            content_hash = hashlib.sha256(file.getbuffer()).hexdigest()
+            existing = ingest_queue.find_by_hash(content_hash, document_key=file.name)
+            if existing:
+                return ingest_queue.add_alias(existing, file.name)
+
             # Create uploads directory if it doesn't exist
             upload_dir = "./uploaded_files"
             os.makedirs(upload_dir, exist_ok=True)
@@ -34,55 +55,32 @@ def process_file(file):
                 new_name = f"{base_name}_{counter}{extension}"
                 file_path = os.path.join(upload_dir, new_name)
             
-            # Save the file
+            # Save the file, streaming from the upload buffer instead of copying it
+            file.seek(0)
             with open(file_path, "wb") as f:
-                f.write(file.getvalue())
-                
-            # Process content based on file type
-            if file.type.startswith('text/') or file.name.endswith(('.txt', '.csv', '.json')):
-                content = file.getvalue().decode("utf-8")
-            elif file.name.endswith('.pdf'):
-                pdf_content = []
-                pdf_file = BytesIO(file.getvalue())
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text.strip():
-                        pdf_content.append(f"Page {page_num + 1}:\n{text}")
-                
-                content = "\n\n".join(pdf_content)
-            elif file.type.startswith('image/'):
-                content = f"Binary image file: {file.name}"
-            else:
-                content = f"Binary file: {file.name}"
+                shutil.copyfileobj(file, f)
             
             # Create metadata
             metadata = {
                 "filename": os.path.basename(file_path),
                 "file_type": file.type,
-                "file_size": len(file.getvalue()),
+                "file_size": file.size,
                 "source": "file_upload",
-                "local_path": file_path
+                "local_path": file_path,
+                # Re-uploads of the same name are versions of one document
+                "document_key": original_name
             }
             
-            # For PDFs, add page count
-            if file.name.endswith('.pdf'):
-                pdf_file = BytesIO(file.getvalue())
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                metadata["page_count"] = len(pdf_reader.pages)
-            
-            # Store in vector database
-            
-            db_manager.store_data("data_store", content, metadata)
-            return file_path
+            # Extraction and embedding happen in the background worker
+            return ingest_queue.enqueue(file_path, file.type, metadata, content_hash=content_hash)
             
         except Exception as e:
             return False, str(e)
         
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+QUERY_SOLVER_URL = os.getenv("QUERY_SOLVER_URL", "http://localhost:8080/api/query_solving/")
+
 # Set page config
 st.set_page_config(
     page_title="Ag Data Fusion Agent",
@@ -223,17 +221,38 @@ with col2:
 
 file_paths = []
 
+# Uploads handled in this session, keyed by the uploader's file id so reruns don't re-hash them
+if "ingest_jobs" not in st.session_state:
+    st.session_state.ingest_jobs = {}
+
 # File upload section
 if st.session_state.get("show_file_upload", False):
     uploaded_files = st.file_uploader("", type=["txt", "image", "csv", "json", "pdf"], accept_multiple_files=True, label_visibility="collapsed")
     if uploaded_files:
         for file in uploaded_files:
+            if file.file_id in st.session_state.ingest_jobs:
+                continue
             result = process_file(file)
             if isinstance(result, tuple):
                 st.error(f"Error processing file: {result[1]}")
             elif result:
-                file_paths.append(result)
-                st.success("File processed and stored successfully!")
+                st.session_state.ingest_jobs[file.file_id] = result["id"]
+
+# Poll the status of this session's ingestion jobs
+ingest_active = False
+for job_id in st.session_state.ingest_jobs.values():
+    job = ingest_queue.get(job_id)
+    if job is None:
+        continue
+    file_paths.append(job["file_path"])
+    name = os.path.basename(job["file_path"])
+    if job["status"] == "done":
+        st.success(f"{name} processed and stored successfully!")
+    elif job["status"] == "failed":
+        st.error(f"Error processing file {name}: {job['error']}")
+    else:
+        ingest_active = True
+        st.progress(job["progress"], text=job["message"] or f"{name}: {job['status']}")
     
 
 # Chat input (this will automatically stay at the bottom)
@@ -244,43 +263,64 @@ if prompt := st.chat_input("Ask me anything..."):
 
     
     
-    # Process and store the user's input
-    # call query solver api located at http://localhost:8080/query_solver/
-    try:
-        response = requests.post("http://localhost:8080/query_solver/", json={"prompt": prompt, "file_paths": file_paths})
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx, 5xx)
-        result = response.json()
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error calling query solver API: {str(e)}")  # For logging
-        full_response = "Sorry, I cannot find an answer"
-        st.error(full_response)
-    
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
     
-    '''
-    # Generate response using OpenAI
+    # Process and store the user's input
+    # call the query solver api and render its server-sent events as they arrive
     with st.chat_message("assistant"):
+        status_placeholder = st.empty()
         message_placeholder = st.empty()
         full_response = ""
         
-        # Stream the response
-        for response in client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant. Use the following context to answer the user's question. If the context is not relevant, use your general knowledge."},
-                {"role": "user", "content": f"Question: {prompt}"}
-            ],
-            stream=True,
-        ):
-            if response.choices[0].delta.content is not None:
-                full_response += response.choices[0].delta.content
-                message_placeholder.markdown(full_response + "▌")
-        
-        message_placeholder.markdown(full_response)
-    '''
+        try:
+            response = requests.post(
+                QUERY_SOLVER_URL,
+                json={"prompt": prompt, "file_paths": file_paths, "stream": True},
+                stream=True,
+                timeout=(5, 300)
+            )
+            response.raise_for_status()  # Raises an HTTPError for bad responses (4xx, 5xx)
+            
+            event_name = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event_name = line[len("event: "):]
+                    continue
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[len("data: "):])
+                
+                if event_name == "stage":
+                    status_placeholder.caption(f"{data['stage'].replace('_', ' ')}: {data['status']}")
+                elif event_name == "token":
+                    full_response += data["text"]
+                    message_placeholder.markdown(full_response + "▌")
+                elif event_name == "reset":
+                    full_response = ""
+                    message_placeholder.empty()
+                elif event_name == "result":
+                    result = data["result"] or {}
+                    answer = result.get("result", "")
+                    full_response = answer if isinstance(answer, str) else json.dumps(answer, indent=2)
+                elif event_name == "error":
+                    raise ValueError(data["error"])
+            
+            status_placeholder.empty()
+            message_placeholder.markdown(full_response)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error calling query solver API: {str(e)}")  # For logging
+            full_response = "Sorry, I cannot find an answer"
+            status_placeholder.empty()
+            st.error(full_response)
+    
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": full_response})
     
     # Store the assistant's response
     #process_text(data_collection, full_response, "assistant_response")
+
+# Keep polling while uploads are still being indexed
+if ingest_active and not prompt:
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,9 @@
+from django.urls import path, include
+
+from api.views import MetricsView
+
+# The api routes without the admin site, which the benchmark doesn't configure
+urlpatterns = [
+    path('api/', include('api.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+]
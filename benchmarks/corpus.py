@@ -0,0 +1,100 @@
+import os
+import random
+
+
+CROPS = ["corn", "soybean", "wheat", "barley", "canola", "alfalfa", "sorghum", "oats"]
+SOILS = ["silt loam", "clay loam", "sandy loam", "loam", "silty clay"]
+PESTS = ["aphids", "corn rootworm", "armyworm", "spider mites", "wireworms", "cutworms"]
+SENTENCES = [
+    "Soil moisture at {depth} cm was {moisture}% after {rain} mm of rain over the previous week.",
+    "Sensor SM_{sensor:02d} reported a canopy temperature of {temp} C at midday.",
+    "Scouting found {pest} at {count} per plant on the north edge of the field.",
+    "Nitrogen was side-dressed at {rate} kg/ha using {product}.",
+    "Stand counts averaged {stand} plants per square metre across {rows} rows.",
+    "The {soil} in the lower section drained slowly and showed ponding near the tile outlet.",
+    "Yield monitor data from the previous season averaged {yield_} t/ha for {crop}.",
+    "Irrigation pivot {pivot} applied {water} mm on {day}.",
+]
+
+
+def synthetic_report(number, paragraphs=6):
+    """A deterministic field report; report n always has the same text"""
+    rng = random.Random(number)
+    crop = rng.choice(CROPS)
+    lines = [f"Field report F-{number:05d}: {crop} on {rng.choice(SOILS)}."]
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(4, 8)):
+            sentences.append(rng.choice(SENTENCES).format(
+                depth=rng.choice([10, 20, 30, 60]),
+                moisture=rng.randint(12, 45),
+                rain=rng.randint(0, 60),
+                sensor=rng.randint(1, 40),
+                temp=round(rng.uniform(18, 36), 1),
+                pest=rng.choice(PESTS),
+                count=rng.randint(1, 40),
+                rate=rng.randint(30, 120),
+                product=rng.choice(["UAN 28%", "urea", "anhydrous ammonia"]),
+                stand=rng.randint(6, 11),
+                rows=rng.randint(4, 16),
+                soil=rng.choice(SOILS),
+                yield_=round(rng.uniform(2.5, 13), 1),
+                crop=crop,
+                pivot=rng.randint(1, 9),
+                water=rng.randint(5, 30),
+                day=f"2023-{rng.randint(4, 9):02d}-{rng.randint(1, 28):02d}"
+            ))
+        lines.append(" ".join(sentences))
+    return "\n\n".join(lines)
+
+
+def synthetic_table(number, rows=500):
+    """CSV text of daily sensor readings for one field"""
+    rng = random.Random(-number - 1)
+    lines = ["field,date,sensor,moisture,temperature,yield"]
+    for row in range(rows):
+        lines.append(
+            f"F-{number:05d},2023-{rng.randint(4, 9):02d}-{rng.randint(1, 28):02d},SM_{rng.randint(1, 40):02d},"
+            f"{rng.randint(12, 45)},{round(rng.uniform(18, 36), 1)},{round(rng.uniform(2.5, 13), 1)}"
+        )
+    return "\n".join(lines)
+
+
+def corpus(size):
+    """Yield (content, metadata) for size synthetic documents; every tenth is a CSV table"""
+    for number in range(size):
+        if number % 10 == 9:
+            yield synthetic_table(number), {"filename": f"sensors_{number:05d}.csv", "file_type": "text/csv",
+                                            "source": "benchmark"}
+        else:
+            yield synthetic_report(number), {"filename": f"report_{number:05d}.txt", "file_type": "text/plain",
+                                             "source": "benchmark"}
+
+
+def write_corpus(directory, size):
+    """Write a corpus as files, e.g. for the bulk ingestion command; returns the directory"""
+    os.makedirs(directory, exist_ok=True)
+    for content, metadata in corpus(size):
+        with open(os.path.join(directory, metadata["filename"]), "w", encoding="utf-8") as f:
+            f.write(content)
+    return directory
+
+
+def queries(count, corpus_size):
+    """Deterministic retrieval queries mixing exact identifiers and natural language"""
+    rng = random.Random(count)
+    templates = [
+        "What was the soil moisture in field F-{number:05d}?",
+        "Which fields reported {pest}?",
+        "Nitrogen rate applied to {crop} fields",
+        "Canopy temperature from sensor SM_{sensor:02d}",
+        "Yield of {crop} on {soil}",
+    ]
+    for _ in range(count):
+        yield rng.choice(templates).format(
+            number=rng.randrange(max(corpus_size, 1)),
+            pest=rng.choice(PESTS),
+            crop=rng.choice(CROPS),
+            sensor=rng.randint(1, 40),
+            soil=rng.choice(SOILS)
+        )
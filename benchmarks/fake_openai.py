@@ -0,0 +1,162 @@
+import re
+import json
+import time
+import math
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from system_prompt import UI_PROMPT, TOOL_SEARCH_PROMPT, WEB_SEARCH_PROMPT
+
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Prompts containing these markers make the fake model send the query further down the pipeline
+NEEDS_WEB = "[needs-web]"
+NEEDS_CODE = "[needs-code]"
+
+
+def fake_embedding(text):
+    """
+    Deterministic unit vector from hashed word counts
+
+    Texts sharing words get similar vectors, so retrieval over a synthetic corpus
+    behaves like it would with real embeddings.
+    """
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSIONS] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def fake_completion(messages):
+    """The assistant message the fake model gives for a solver prompt"""
+    system, user = messages[0]["content"], messages[-1]["content"]
+    if system == UI_PROMPT:
+        return "chat"
+    if system == TOOL_SEARCH_PROMPT:
+        code = 'output = {"result": "computed by generated code", "complete": "True"}'
+        return json.dumps(code)
+    needs_more = NEEDS_CODE in user or (NEEDS_WEB in user and system != WEB_SEARCH_PROMPT)
+    answer = f"Synthetic answer based on {len(user)} characters of context."
+    return json.dumps({"result": answer, "complete": "False" if needs_more else "True"})
+
+
+class _Server(ThreadingHTTPServer):
+    # Async clients open many connections at once; the default listen backlog of 5 refuses them
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server.fake
+        with server.lock:
+            server.requests[self.path] = server.requests.get(self.path, 0) + 1
+
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            time.sleep(server.embedding_latency + server.embedding_latency_per_input * len(inputs))
+            tokens = sum(len(text) // 4 for text in inputs)
+            self._send_json({
+                "object": "list",
+                "model": request.get("model"),
+                "data": [{"object": "embedding", "index": index, "embedding": fake_embedding(text)}
+                         for index, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+            return
+
+        if self.path.endswith("/chat/completions"):
+            content = fake_completion(request["messages"])
+            prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            time.sleep(server.completion_latency)
+            if not request.get("stream"):
+                self._send_json({
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                              "total_tokens": prompt_tokens + len(content) // 4}
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [content[start:start + 8] for start in range(0, len(content), 8)] + [None]
+            for piece in pieces:
+                time.sleep(server.token_latency)
+                chunk = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": piece} if piece else {},
+                                 "finish_reason": None if piece else "stop"}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        self.send_error(404)
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI chat completion and embedding endpoints
+
+    Responses are deterministic; latencies are in seconds per request (plus per input
+    for embeddings and per 8-character piece for streamed completions). Point clients
+    at it with OPENAI_BASE_URL=server.base_url.
+    """
+
+    def __init__(self, completion_latency=0.0, token_latency=0.0, embedding_latency=0.0,
+                 embedding_latency_per_input=0.0, host="127.0.0.1", port=0):
+        self.completion_latency = completion_latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.requests = {}
+        self.lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
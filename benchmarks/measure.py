@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # peak RSS of the whole run is unavailable on Windows
+    resource = None
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    rank = max(0, min(len(sorted_samples) - 1, int(round(fraction * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[rank]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    ordered = sorted(samples)
+    milliseconds = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(ordered),
+        "mean_ms": milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": milliseconds(percentile(ordered, 0.50)),
+        "p95_ms": milliseconds(percentile(ordered, 0.95)),
+        "p99_ms": milliseconds(percentile(ordered, 0.99)),
+        "max_ms": milliseconds(ordered[-1]) if ordered else None
+    }
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    """Peak resident set size of this process so far, in bytes"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """Peak RSS while a phase runs, sampled from /proc every interval seconds"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / (1024 * 1024), 1) if self.peak is not None else None
+
+
+def run_load(function, items, concurrency=1):
+    """
+    Call function(item) for every item with concurrency threads
+
+    Returns the latency summary plus throughput and peak RSS, and the call results.
+    """
+    items = list(items)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(item):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            result = function(item)
+        except Exception as e:
+            print(f"Benchmark call failed: {str(e)}")
+            result = None
+            with lock:
+                errors += 1
+        with lock:
+            latencies.append(time.perf_counter() - started)
+        return result
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        if concurrency <= 1:
+            results = [timed(item) for item in items]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(timed, items))
+        seconds = time.perf_counter() - started
+
+    report = summarize(latencies)
+    report.update({
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "throughput_per_second": round(len(items) / seconds, 2) if seconds else None,
+        "peak_rss_mb": rss.peak_mb
+    })
+    return report, results
+
+
+async def arun_load(function, items, concurrency=1):
+    """run_load for a coroutine function: up to concurrency calls in flight on the running event loop"""
+    items = list(items)
+    latencies = []
+    errors = 0
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def timed(item):
+        nonlocal errors
+        async with slots:
+            started = time.perf_counter()
+            try:
+                result = await function(item)
+            except Exception as e:
+                print(f"Benchmark call failed: {str(e)}")
+                result = None
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            return result
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(timed(item) for item in items))
+        seconds = time.perf_counter() - started
+
+    report = summarize(latencies)
+    report.update({
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "throughput_per_second": round(len(items) / seconds, 2) if seconds else None,
+        "peak_rss_mb": rss.peak_mb
+    })
+    return report, results
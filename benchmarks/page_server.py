@@ -0,0 +1,101 @@
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from corpus import synthetic_report
+
+
+class _Server(ThreadingHTTPServer):
+    # Async clients open many connections at once; the default listen backlog of 5 refuses them
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type, headers=None):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.pages
+        url = urlparse(self.path)
+        time.sleep(server.latency)
+
+        if url.path == "/customsearch/v1":
+            # Same shape as the Google Custom Search response the SearchAPI reads
+            query = parse_qs(url.query).get("q", [""])[0]
+            num = int(parse_qs(url.query).get("num", ["5"])[0])
+            seed = int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16)
+            items = []
+            for rank in range(num):
+                page = (seed + rank) % server.page_count
+                items.append({
+                    "title": f"Field report {page}",
+                    "link": f"{server.base_url}/pages/{page}.html",
+                    "snippet": synthetic_report(page)[:160]
+                })
+            self._send(json.dumps({"items": items}), "application/json")
+            return
+
+        if url.path.startswith("/pages/") and url.path.endswith(".html"):
+            page = int(url.path[len("/pages/"):-len(".html")])
+            etag = f'"page-{page}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in synthetic_report(page).split("\n\n"))
+            html = (f"<html><head><title>Field report {page}</title><style>p {{margin: 0}}</style></head>"
+                    f"<body><h1>Field report {page}</h1>{paragraphs}<script>var x = 1;</script></body></html>")
+            self._send(html, "text/html; charset=utf-8", {"ETag": etag, "Cache-Control": "max-age=0"})
+            return
+
+        self.send_error(404)
+
+
+class PageServer:
+    """
+    Local web for SearchAPI: a Custom Search compatible endpoint and synthetic HTML pages
+
+    Point the SearchAPI at it with GOOGLE_SEARCH_URL=server.search_url.
+    """
+
+    def __init__(self, page_count=1000, latency=0.0, host="127.0.0.1", port=0):
+        self.page_count = page_count
+        self.latency = latency
+        self._server = _Server((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.pages = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="page-server", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def search_url(self):
+        return f"{self.base_url}/customsearch/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,301 @@
+"""
+End-to-end benchmarks for ingestion, retrieval, web search and the query_solving endpoint
+
+External services are replaced by local stand-ins: a fake OpenAI server for completions
+and embeddings, a page server for Custom Search and result pages, and Chroma in a
+scratch directory. Each corpus size runs in its own process, so singletons and peak
+RSS are per size. Results are written as JSON to benchmarks/results/; pass an earlier
+file with --compare to see the change in latency and throughput.
+
+    python benchmarks/run.py --sizes 100,1000 --completion-latency 0.3
+    python benchmarks/run.py --compare benchmarks/results/<earlier run>.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+from corpus import corpus, queries
+from measure import run_load, arun_load, summarize, max_rss
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the query solver against local stand-ins")
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated corpus sizes (documents)")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per mode")
+    parser.add_argument("--search-queries", type=int, default=50, help="Web searches, run cold then warm")
+    parser.add_argument("--requests", type=int, default=30, help="query_solving requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients for queries and requests")
+    parser.add_argument("--ingest-concurrency", type=int, default=1, help="Concurrent store_data calls")
+    parser.add_argument("--completion-latency", type=float, default=0.2, help="Fake chat completion latency (s)")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Delay per streamed piece (s)")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Fake embedding request latency (s)")
+    parser.add_argument("--embedding-latency-per-input", type=float, default=0.0005, help="Extra latency per input (s)")
+    parser.add_argument("--page-latency", type=float, default=0.02, help="Local page server latency (s)")
+    parser.add_argument("--caches", action="store_true", help="Keep the answer and code caches enabled")
+    parser.add_argument("--skip", default="", help="Comma-separated phases to skip: ingest,retrieval,search,endpoint")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--workdir", default=None, help="Scratch directory (default: a temporary one, removed after)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--single-size", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def _setup_django():
+    import django
+    from django.conf import settings
+    from project.settings import REST_FRAMEWORK
+
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY="benchmark",
+        ALLOWED_HOSTS=["*"],
+        ROOT_URLCONF="bench_urls",
+        INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth", "rest_framework", "api"],
+        REST_FRAMEWORK=REST_FRAMEWORK,
+        DATABASES={}
+    )
+    django.setup()
+
+
+def _bench_ingest(db_manager, size, args):
+    documents = list(corpus(size))
+    report, _ = run_load(
+        lambda document: db_manager.store_data("data_store", document[0], document[1]),
+        documents,
+        args.ingest_concurrency
+    )
+    chunks = db_manager.get_collection("data_store").count()
+    report.update({
+        "documents": size,
+        "chunks": chunks,
+        "chunks_per_second": round(chunks / report["seconds"], 2) if report["seconds"] else None
+    })
+    return report
+
+
+def _bench_retrieval(db_manager, size, args):
+    texts = list(queries(args.queries, size))
+    report = {}
+    for mode in RETRIEVAL_MODES:
+        # The first query of a mode may build in-memory state; report it separately
+        started = time.perf_counter()
+        db_manager.query_data("data_store", texts[0], 8, mode=mode, include=["documents", "metadatas"])
+        first_ms = round((time.perf_counter() - started) * 1000, 3)
+        report[mode], _ = run_load(
+            lambda text: db_manager.query_data("data_store", text, 8, mode=mode, include=["documents", "metadatas"]),
+            texts,
+            args.concurrency
+        )
+        report[mode]["first_query_ms"] = first_ms
+    return report
+
+
+def _bench_search(size, args):
+    from search_api import SearchAPI
+
+    search_api = SearchAPI(api_key="benchmark")
+    texts = [f"{text} ({index})" for index, text in enumerate(queries(args.search_queries, size))]
+    report = {}
+    for phase in ("cold", "warm"):
+        report[phase], _ = run_load(lambda text: search_api.search(text, max_results=5), texts, args.concurrency)
+    report["caches"] = search_api.cache_stats()
+    return report
+
+
+def _bench_endpoint(size, args):
+    from django.test import AsyncClient
+    from api.query_solver import get_query_solver
+    from fake_openai import NEEDS_WEB, NEEDS_CODE
+
+    get_query_solver()  # built once, outside the measurements
+    # query_solving is an async view: requests share one event loop, as under ASGI
+    client = AsyncClient()
+
+    async def post(prompt):
+        response = await client.post("/api/query_solving/", data=json.dumps({"prompt": prompt}),
+                                     content_type="application/json")
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.content[:200]!r}")
+        return response
+
+    async def stream(prompt):
+        started = time.perf_counter()
+        response = await client.post("/api/query_solving/", data=json.dumps({"prompt": prompt, "stream": True}),
+                                     content_type="application/json")
+        first_token = None
+        async for chunk in response.streaming_content:
+            if first_token is None and b"event: token" in chunk:
+                first_token = time.perf_counter() - started
+        return first_token
+
+    async def scenarios():
+        # One unmeasured request loads the tokenizer, HNSW index and connection pools
+        await post("warm-up request")
+
+        report = {}
+        texts = list(queries(args.requests, size))
+        for scenario, marker in (("data", ""), ("web", f" {NEEDS_WEB}"), ("code", f" {NEEDS_CODE}")):
+            prompts = [f"{text}{marker} (request {index})" for index, text in enumerate(texts)]
+            report[scenario], _ = await arun_load(post, prompts, args.concurrency)
+
+        prompts = [f"{text} (stream {index})" for index, text in enumerate(texts)]
+        report["stream"], first_tokens = await arun_load(stream, prompts, args.concurrency)
+        report["stream"]["time_to_first_token"] = summarize([value for value in first_tokens if value is not None])
+        return report
+
+    return asyncio.run(scenarios())
+
+
+def run_size(size, args):
+    """Run every phase for one corpus size in the current directory; returns the results"""
+    # Imported here: the parent process only orchestrates and has no app modules on its path
+    from fake_openai import FakeOpenAIServer
+    from page_server import PageServer
+    from db_manager import get_db_manager
+
+    openai_server = FakeOpenAIServer(
+        completion_latency=args.completion_latency,
+        token_latency=args.token_latency,
+        embedding_latency=args.embedding_latency,
+        embedding_latency_per_input=args.embedding_latency_per_input
+    ).start()
+    page_server = PageServer(page_count=max(size, 100), latency=args.page_latency).start()
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": openai_server.base_url,
+        "SEARCH_API_KEY": "benchmark",
+        "GOOGLE_SEARCH_ENGINE_ID": "benchmark",
+        "GOOGLE_SEARCH_URL": page_server.search_url,
+        "QUERY_SOLVER_WARMUP": "0",
+        "ANSWER_CACHE": "1" if args.caches else "0",
+        "CODE_CACHE": "1" if args.caches else "0",
+        # The stand-in has no rate limits to pace to; keep only the concurrency caps
+        "LLM_LIMITS": json.dumps({model: {"rpm": 0, "tpm": 0, "concurrency": 64}
+                                  for model in ("gpt-4", "text-embedding-ada-002", "*")})
+    })
+    skip = set(filter(None, args.skip.split(",")))
+
+    db_manager = get_db_manager("./vector_db")
+    result = {}
+    if "ingest" not in skip:
+        result["ingest"] = _bench_ingest(db_manager, size, args)
+    if "retrieval" not in skip:
+        result["retrieval"] = _bench_retrieval(db_manager, size, args)
+    if "search" not in skip:
+        result["search"] = _bench_search(size, args)
+    if "endpoint" not in skip:
+        _setup_django()
+        result["endpoint"] = _bench_endpoint(size, args)
+    result["db_latency"] = db_manager.latency_stats()
+    result["fake_openai_requests"] = dict(openai_server.requests)
+    result["peak_rss_mb"] = round(max_rss() / (1024 * 1024), 1) if max_rss() else None
+
+    page_server.stop()
+    openai_server.stop()
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _latency_rows(node, path=()):
+    """Yield (path, summary) for every latency summary in a results tree"""
+    if isinstance(node, dict):
+        if "p50_ms" in node:
+            yield "/".join(path), node
+        for key, value in node.items():
+            yield from _latency_rows(value, path + (key,))
+
+
+def print_summary(size, result):
+    print(f"\n== {size} documents (peak RSS {result.get('peak_rss_mb')} MB)")
+    for path, row in _latency_rows(result):
+        throughput = row.get("throughput_per_second")
+        print(f"  {path:<32} p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms"
+              + (f"  {throughput}/s" if throughput is not None else "")
+              + (f"  {row['errors']} errors" if row.get("errors") else ""))
+
+
+def compare(baseline, current):
+    print(f"\n== Compared with {baseline.get('commit', 'unknown')[:10]} ({baseline.get('timestamp')})")
+    for size, result in current["results"].items():
+        previous = dict(_latency_rows(baseline.get("results", {}).get(size, {})))
+        for path, row in _latency_rows(result):
+            before = previous.get(path)
+            if not before:
+                continue
+            changes = []
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_second"):
+                if before.get(metric) and row.get(metric) is not None:
+                    changes.append(f"{metric} {before[metric]} -> {row[metric]} ({(row[metric] / before[metric] - 1) * 100:+.1f}%)")
+            print(f"  {size}/{path}: " + ", ".join(changes))
+
+
+def main():
+    args = parse_args()
+    if args.single_size is not None:
+        result = run_size(args.single_size, args)
+        with open(args.result_file, "w") as f:
+            json.dump(result, f, indent=2)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="query-solver-bench-")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.join(REPO_ROOT, "api"), REPO_ROOT, os.path.join(REPO_ROOT, "benchmarks")]
+        + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])
+    ))
+    results = {}
+    try:
+        for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+            directory = os.path.join(workdir, f"size_{size}")
+            os.makedirs(directory, exist_ok=True)
+            result_file = os.path.join(directory, "result.json")
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                 "--single-size", str(size), "--result-file", result_file],
+                cwd=directory, env=env, check=True
+            )
+            with open(result_file) as f:
+                results[str(size)] = json.load(f)
+            print_summary(size, results[str(size)])
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = _git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("single_size", "result_file", "output_dir", "workdir", "compare")}
+    report = {"commit": commit, "timestamp": timestamp, "python": sys.version.split()[0], "config": config,
+              "results": results}
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{timestamp}-{commit[:10]}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
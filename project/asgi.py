@@ -0,0 +1,15 @@
+"""
+ASGI config for the project
+
+Serves the async query_solving view from one event loop, so queries waiting on
+OpenAI or web fetches don't each hold a worker thread:
+
+    PYTHONPATH=api uvicorn project.asgi:application --host 0.0.0.0 --port 8000
+"""
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+
+application = get_asgi_application()